@@ -42,11 +42,143 @@ import maya.OpenMaya as OpenMaya
 import maya.OpenMayaUI as omUI
 import maya.cmds as cmds
 import maya.mel as mel
+import maya.utils
+import MacroToolsSync
 
-from functools import partial
+from collections import deque
+from functools import partial, wraps
 from PySide2 import QtWidgets, QtGui, QtCore
 from shiboken2 import wrapInstance
-import os, sys, subprocess
+import os, shutil, sys, subprocess
+import csv, gzip, hashlib, io, json, re, threading, time
+
+try:
+    import Queue as queue  # Python 2
+except ImportError:
+    import queue
+
+
+# Operation Metrics
+# Every user facing operation records its wall time, bytes read and written and file system calls
+# into a rolling buffer. The buffer can be exported to JSON or CSV or viewed in the summary panel.
+
+operationMetrics = deque(maxlen=1000)
+_operationMetricsLock = threading.Lock()  # The background threads add metrics while the panel reads them
+operationMetricFields = ('operation', 'macroFolderPath', 'startTime', 'wallTime', 'bytesRead', 'bytesWritten', 'fileSystemCalls')
+_operationState = threading.local()  # Operations are tracked per thread for the background I/O
+
+
+def _getActiveOperations():
+    if not hasattr(_operationState, 'activeOperations'):
+        _operationState.activeOperations = []
+    return _operationState.activeOperations
+
+
+def startOperationMetric(operation, macroFolderPath):
+    """
+    Start timing an operation on the current thread.
+    :return: The metric to pass to finishOperationMetric
+    """
+    metric = {
+        'operation': operation,
+        'macroFolderPath': macroFolderPath,
+        'startTime': time.time(),
+        'wallTime': 0.0,
+        'bytesRead': 0,
+        'bytesWritten': 0,
+        'fileSystemCalls': 0}
+    _getActiveOperations().append(metric)
+    return metric
+
+
+def finishOperationMetric(metric):
+    """
+    Stop timing an operation and add it to the rolling buffer.
+    """
+    metric['wallTime'] = time.time() - metric['startTime']
+    _getActiveOperations().remove(metric)
+    with _operationMetricsLock:
+        operationMetrics.append(metric)
+
+
+def getOperationMetrics():
+    """
+    Return a copy of the recorded operation metrics, oldest first.
+    """
+    with _operationMetricsLock:
+        return list(operationMetrics)
+
+
+def recordFileSystemCall(calls=1, bytesRead=0, bytesWritten=0):
+    """
+    Add file system activity to every operation that is currently being timed on this thread.
+    Nested operations also count towards the operations that called them.
+    """
+    for metric in _getActiveOperations():
+        metric['fileSystemCalls'] += calls
+        metric['bytesRead'] += bytesRead
+        metric['bytesWritten'] += bytesWritten
+
+
+def timedOperation(operation):
+    """
+    Decorator recording the metrics of a MacroTools method.
+    :param operation: The operation name, or a function returning the name from the method arguments
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            name = operation(*args, **kwargs) if callable(operation) else operation
+            metric = startOperationMetric(name, self.macroFolderPath)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                finishOperationMetric(metric)
+        return wrapper
+    return decorator
+
+
+def summarizeOperationMetrics():
+    """
+    Return the count, total and max wall time and file system totals for each operation and folder.
+    """
+    summary = {}
+    for metric in getOperationMetrics():
+        key = (metric['operation'], metric['macroFolderPath'])
+        entry = summary.setdefault(key, {
+            'operation': metric['operation'],
+            'macroFolderPath': metric['macroFolderPath'],
+            'count': 0,
+            'totalTime': 0.0,
+            'maxTime': 0.0,
+            'bytesRead': 0,
+            'bytesWritten': 0,
+            'fileSystemCalls': 0})
+        entry['count'] += 1
+        entry['totalTime'] += metric['wallTime']
+        entry['maxTime'] = max(entry['maxTime'], metric['wallTime'])
+        entry['bytesRead'] += metric['bytesRead']
+        entry['bytesWritten'] += metric['bytesWritten']
+        entry['fileSystemCalls'] += metric['fileSystemCalls']
+
+    # Slowest operations first
+    return sorted(summary.values(), key=lambda entry: entry['totalTime'], reverse=True)
+
+
+def exportOperationMetrics(exportPath):
+    """
+    Export the recorded operation metrics to a .json or .csv file.
+    :param exportPath: The file to write, the format is chosen from the extension
+    """
+    if exportPath.lower().endswith('.csv'):
+        with open(exportPath, 'w') as openExportFile:
+            writer = csv.DictWriter(openExportFile, fieldnames=operationMetricFields, lineterminator='\n')
+            writer.writeheader()
+            for metric in getOperationMetrics():
+                writer.writerow(metric)
+    else:
+        with open(exportPath, 'w') as openExportFile:
+            json.dump(getOperationMetrics(), openExportFile, indent=4)
 
 
 class MacroTools:
@@ -59,6 +191,14 @@ class MacroTools:
         self.macroFolderPath = 'null'  # Using a null arg with os.path.exists causes an error
         self.macroPrefix = ''  # No prefix
         self.recording = False
+        self.recordingPath = ''
+        self.commandRecorder = None
+        self.segmentWriter = None
+        self.segmentTimer = None
+
+        # Performance Summary UI
+        self.metricsWindow = 'MacroToolsMetricsWindow'
+        self.metricsScrollField = ''
 
         # Rename UI
         self.renameWindow = ''
@@ -115,9 +255,21 @@ class MacroTools:
         self.macroOption = ''
         self.openMacroFile = ''
 
+        self.playlistMenu = ''
+        self.playlists = None  # Playlist names from the last background listing
+
         self.activeMacroBackUps = []
         self.backUpsIndex = 1
 
+        # Macro files are read and written in the background, the UI works from these in memory copies
+        self.macroFiles = {}  # Macro name to file name from the last listing
+        self.activeMacroText = ''
+        self.activeMacroLoaded = False
+        self.activeMacroVersion = 0
+        self.activeMacroModifiedTime = None
+        self.macroFolderModifiedTime = None
+        self.pendingIOCount = 0
+
         # Script Editor Output Settings
         self.old_echoAllLines = ''
         self.old_showLineNumbersIsOn = ''
@@ -162,16 +314,40 @@ class MacroTools:
         if cmds.windowPref(self.window, exists=True):
             cmds.windowPref(self.window, e=True, w=600, h=340)
 
-        cmds.window(self.window, t=self.windowName, w=600, h=340, mb=True)
+        # Closing the window only hides it so show() can bring it back with its state
+        cmds.window(self.window, t=self.windowName, w=600, h=340, mb=True, retain=True)
         layout = cmds.formLayout(p=self.window)
 
         cmds.menu(l='Options')
         cmds.menuItem(l='Open Macro Folder Path', c=partial(self._openMacroFolderPath))
         cmds.menuItem(l='Change Macro Folder Path', c=partial(self._changeMacroFolderPath, True))
+        cmds.menuItem(l='Sync Macro Folder...', c=self._syncMacroFolderButton)
+        cmds.menuItem(divider=True)
+        cmds.menuItem(l='Compress Macros (gzip)', c=partial(self._convertMacrosButton, 'gzip'))
+        if zstandard is not None:
+            cmds.menuItem(l='Compress Macros (zstd)', c=partial(self._convertMacrosButton, 'zstd'))
+        cmds.menuItem(l='Decompress Macros', c=partial(self._convertMacrosButton, 'none'))
+        cmds.menuItem(divider=True)
+        cmds.menuItem(
+            l='Record With Command Callbacks',
+            cb=getRecordingBackend() == 'callback',
+            c=self._toggleRecordingBackend)
+        cmds.menuItem(
+            l='Segment Long Recordings',
+            cb=getRecordingSegmentSize() > 0,
+            c=self._toggleRecordingSegments)
+        cmds.menuItem(l='Validate Segmented Macro', c=self._validateSegmentsButton)
+        cmds.menuItem(divider=True)
+        cmds.menuItem(l='Iterate Macro From Table...', c=self._iterateMacroButton)
+        cmds.menuItem(divider=True)
+        cmds.menuItem(l='Performance Summary', c=self._openMetricsWindow)
 
         # Commented out until the rest of the prefix functionality is built
         #cmds.menuItem(l='Update Macro Prefix')#, c=partial(self._openAbout))
 
+        # Playlists are listed when the menu is opened so new playlists show up without a rebuild
+        self.playlistMenu = cmds.menu(l='Playlists', postMenuCommand=self._buildPlaylistMenu)
+
         # Left Column UI Holds the Debug Button, Create Macro frameLayout, and Active Macro frameLayout
         leftColumn = cmds.columnLayout(adjustableColumn=True, p=layout, w=300, h=190)
         cmds.formLayout(layout, e=True, af=(leftColumn, 'top', 5))
@@ -271,12 +447,65 @@ class MacroTools:
         cmds.formLayout(layout, e=True, aoc=(self.macroCancelEditButton, 'bottom', -30, self.macroScrollField))
         cmds.formLayout(layout, e=True, af=(self.macroCancelEditButton, 'right', 5))
 
-        # Refresh the macro list
+        # Refresh the macro list, the active macro is loaded once the list arrives
         self._listMacros()
-        self._loadMacroButton()
 
         cmds.showWindow(self.window)
 
+    def _isWindowBuilt(self):
+        """
+        Return True if the window and the controls of this instance still exist.
+        MacroTools() replaces the window of the same name, leaving an older instance without controls.
+        """
+        return (cmds.window(self.window, exists=True) and bool(self.macroSaveEditButton) and
+                cmds.control(self.macroSaveEditButton, exists=True))
+
+    def _reopen(self):
+        """
+        Show the existing window again and refresh only what changed on disk while it was hidden.
+        """
+        cmds.showWindow(self.window)
+
+        # The folder was changed from another MacroTools window
+        macroFolderPath = cmds.optionVar(q='MacroToolsDirectory')
+        if macroFolderPath and macroFolderPath != self.macroFolderPath:
+            self.macroFolderPath = macroFolderPath
+            self.playlists = None
+            self._listMacros()
+            return
+
+        # Leave recordings and unsaved edits alone
+        if self.recording or cmds.button(self.macroSaveEditButton, q=True, en=True):
+            return
+
+        self._submitMacroIO(
+            self.macroFolderPath,
+            getModifiedTime,
+            (self.macroFolderPath,),
+            callback=self._checkMacroFolderModified,
+            operation='checkModified')
+        if self.activeMacro:
+            self._submitMacroIO(
+                self.activeMacroPath,
+                getModifiedTime,
+                (self.activeMacroPath,),
+                callback=partial(self._checkActiveMacroModified, self.activeMacroPath),
+                operation='checkModified')
+
+    def _checkMacroFolderModified(self, modifiedTime):
+        """
+        Refresh the macro list if macros were added or removed.
+        """
+        if modifiedTime != self.macroFolderModifiedTime:
+            self._listMacros(selectMacro=self.activeMacro, loadMacro=False)
+
+    def _checkActiveMacroModified(self, macroPath, modifiedTime):
+        """
+        Load the active macro again if it was changed outside of the window.
+        """
+        if macroPath == self.activeMacroPath and modifiedTime != self.activeMacroModifiedTime:
+            self._resetMacroScrollField()
+
     def _debugButton(self, *args):
         """
         Debugging button, handy for testing.
@@ -332,12 +561,103 @@ class MacroTools:
 
         if newDirectory:
             self.macroFolderPath = newDirectory[0]
+            self.playlists = None
 
         cmds.optionVar(sv=('MacroToolsDirectory', self.macroFolderPath))
 
         if refresh:
             self._listMacros()
 
+    def _openMetricsWindow(self, *args):
+        """
+        Opens the window summarizing the timing of each operation.
+        """
+        if cmds.window(self.metricsWindow, exists=True):
+            cmds.deleteUI(self.metricsWindow)
+
+        cmds.window(self.metricsWindow, title='MacroTools Performance Summary', widthHeight=(700, 300))
+        layout = cmds.formLayout()
+        self.metricsScrollField = cmds.scrollField(editable=False, wordWrap=False, font='fixedWidthFont')
+        buttons = cmds.rowLayout(numberOfColumns=3)
+        cmds.button(l='Refresh', w=80, command=self._refreshMetricsWindow)
+        cmds.button(l='Export JSON', w=80, command=partial(self._exportMetricsButton, 'json'))
+        cmds.button(l='Export CSV', w=80, command=partial(self._exportMetricsButton, 'csv'))
+        cmds.setParent('..')
+
+        cmds.formLayout(layout, e=True, af=[(self.metricsScrollField, 'top', 5),
+                                            (self.metricsScrollField, 'left', 5),
+                                            (self.metricsScrollField, 'right', 5),
+                                            (buttons, 'left', 5),
+                                            (buttons, 'bottom', 5)])
+        cmds.formLayout(layout, e=True, ac=(self.metricsScrollField, 'bottom', 5, buttons))
+
+        self._refreshMetricsWindow()
+        cmds.showWindow(self.metricsWindow)
+
+    def _refreshMetricsWindow(self, *args):
+        """
+        Show the summary of the recorded operation metrics in the metrics window.
+        """
+        lines = ['%-16s %6s %10s %10s %12s %12s %8s  %s' % (
+            'Operation', 'Count', 'Total (s)', 'Max (s)', 'Read (B)', 'Written (B)', 'FS Calls', 'Folder')]
+        for entry in summarizeOperationMetrics():
+            lines.append('%-16s %6d %10.4f %10.4f %12d %12d %8d  %s' % (
+                entry['operation'], entry['count'], entry['totalTime'], entry['maxTime'],
+                entry['bytesRead'], entry['bytesWritten'], entry['fileSystemCalls'], entry['macroFolderPath']))
+        lines.append('')
+        lines.append('Operations named parent/child ran on a background thread for the parent operation,')
+        lines.append('the parent operation only times handing the work over.')
+        lines.append('Read and written bytes are the bytes on disk, compressed macros count their compressed size.')
+        cmds.scrollField(self.metricsScrollField, e=True, text='\n'.join(lines))
+
+    def _exportMetricsButton(self, fileFormat, *args):
+        """
+        Export the recorded operation metrics to a file chosen by the user.
+        :param fileFormat: 'json' or 'csv'
+        """
+        exportPath = cmds.fileDialog2(
+            fileMode=0,
+            fileFilter='%s Files (*.%s)' % (fileFormat.upper(), fileFormat),
+            okCaption='Export',
+            caption='Export Performance Metrics')
+        if not exportPath:
+            return
+        exportOperationMetrics(exportPath[0])
+
+    @timedOperation('syncMacroFolder')
+    def _syncMacroFolderButton(self, *args):
+        """
+        Synchronize the macro folder with another folder, only copying what changed since the last sync.
+        """
+        # A recording is still being written and could be copied half finished
+        if self.recording:
+            OpenMaya.MGlobal_displayError('The macro folder can not be synced while recording')
+            return
+
+        otherDirectory = cmds.fileDialog2(
+            fileMode=3,
+            okCaption='Sync',
+            caption='Select the Macro Folder to Sync With')
+        if not otherDirectory:
+            return
+        if os.path.normcase(os.path.abspath(otherDirectory[0])) == os.path.normcase(os.path.abspath(self.macroFolderPath)):
+            OpenMaya.MGlobal_displayError('Select a different folder to sync with')
+            return
+
+        getMacroIOWorker().wait()
+        try:
+            report = MacroToolsSync.syncMacroFolders(self.macroFolderPath, otherDirectory[0])
+        except (IOError, OSError) as error:
+            OpenMaya.MGlobal_displayError(str(error))
+            return
+
+        print(MacroToolsSync.formatSyncReport(report))
+        for fileName, reason in report['conflicts']:
+            OpenMaya.MGlobal_displayWarning('Sync conflict: ' + fileName + ', ' + reason)
+
+        # Macros may have been added, removed or changed
+        self._listMacros(selectMacro=self.activeMacro)
+
     def _openRenameWindow(self, *args):
         """
         Opens the window for renaming the active macro.
@@ -388,9 +708,11 @@ class MacroTools:
             newName = self.macroPrefix + newName
 
         oldPath = self.activeMacroPath
-        self.activeMacroPath = self.activeMacroPath.rsplit('/', 1)[0] + '/' + newName + '.txt'
+        extension = splitMacroExtension(oldPath)[1]
+        self.activeMacroPath = self.activeMacroPath.rsplit('/', 1)[0] + '/' + newName + extension
 
-        # Rename the macro file
+        # Rename the macro file once pending writes have finished
+        getMacroIOWorker().wait(oldPath)
         try:
             os.rename(oldPath, self.activeMacroPath)
         except OSError:
@@ -399,8 +721,7 @@ class MacroTools:
             return
 
         # Refresh macro list
-        self._listMacros()
-        cmds.optionMenu(self.macroOption, e=True, v=newName)
+        self._listMacros(selectMacro=newName, loadMacro=False)
         #self._loadMacroButton()
 
         # Set the preferences
@@ -416,6 +737,7 @@ class MacroTools:
         textToClipBoard = cmds.scrollField(self.macroScrollField, q=True, text=True)
         QtWidgets.QApplication.clipboard().setText(textToClipBoard)
 
+    @timedOperation('undo')
     def _undoButton(self, *args):
         """
         Save the last string in the list of backups to the active macro, decrementing.
@@ -432,6 +754,7 @@ class MacroTools:
             print('index error')
             return
 
+    @timedOperation('redo')
     def _redoButton(self, *args):
         """
         Save the next string in the list of backups to the active macro, incrementing.
@@ -482,6 +805,7 @@ class MacroTools:
         cmds.button(self.macroCancelEditButton, e=True, en=True)
         self._toggleActiveUI(enable=False, includeStopButton=False, includeCreateUI=True)
 
+    @timedOperation('save')
     def _saveButton(self, *args):
         """
         Save the current scrollField text to the active macro and toggle editing UI elements on/off.
@@ -507,8 +831,8 @@ class MacroTools:
         cmds.button(self.macroCancelEditButton, e=True, en=False)
         self._toggleActiveUI(enable=True, includeStopButton=False, includeCreateUI=True)
 
-        # Reset the scroll field
-        self._resetMacroScrollField()
+        # Reset the scroll field to the last saved text
+        self._showMacroText(self._getActiveMacroText())
 
     def _saveStringToMacro(self, newText='', *args):
         """
@@ -516,15 +840,23 @@ class MacroTools:
         If undo is true, save the backup to the active macro.
         :param newText: The content to be saved to the macro. default is empty.
         """
-        # Write to file
-        with open(self.activeMacroPath, 'w') as openMacroFile:
-            openMacroFile.write(newText)
+        # Write to file in the background, writes to the same file stay in order
+        invalidateMacroProcedure(self.activeMacroPath)
+        self.activeMacroText = newText
+        self.activeMacroLoaded = True
+        self.activeMacroVersion += 1
+        self._submitMacroIO(
+            self.activeMacroPath,
+            writeMacroFileWithModifiedTime,
+            (self.activeMacroPath, newText),
+            callback=partial(self._macroWritten, self.activeMacroPath),
+            operation='writeMacro')
 
         # with open(self.activeMacroPath) as openMacroFile:
         #     print(openMacroFile.read())
 
         # Update the scroll field to reflect the changes
-        self._resetMacroScrollField()
+        self._showMacroText(newText)
 
     def _checkCreateMacro(self, *args):
         """
@@ -535,36 +867,55 @@ class MacroTools:
         message = ' already exists. Do you want to replace it?'  # Macro name is added to message
         icon = 'question'
 
-        # If the new macro name is already taken ask the user to overwrite
+        # The folder may be shared or still being listed, so look for the macro on disk in the background
         newMacroName = cmds.textFieldButtonGrp(self.macroFileField, q=True, tx=True)
         if newMacroName:
-            for macro in self._getMacros():
-                # Check if new macro name is taken
-                macroName = macro.split('.txt')[0]
-                if macroName == newMacroName and self._dialogBool(title, macro + message, icon) is True:
-                    # Overwrite the macro and return
-                    self._createMacro(newMacroName)
-                    return
-            # Name is not taken, create the macro
-            self._createMacro(newMacroName)
+            self._submitMacroIO(
+                self.macroFolderPath,
+                findExistingMacroPath,
+                (self.macroFolderPath, newMacroName, self.macroPrefix),
+                callback=partial(self._confirmCreateMacro, newMacroName),
+                operation='findMacro')
         else:
             OpenMaya.MGlobal_displayError('No new macro file is defined')
 
-    def _createMacro(self, newMacroName):
+    def _confirmCreateMacro(self, newMacroName, existingMacroPath):
+        """
+        Create the new macro, if the macro name is already taken ask the user to overwrite
+        :param newMacroName: The name of the new macro
+        :param existingMacroPath: The path of the macro with the same name, None if there is none
+        """
+        # Dialog Message Contents
+        title = 'Create Macro'
+        message = ' already exists. Do you want to replace it?'  # Macro name is added to message
+        icon = 'question'
+
+        if existingMacroPath:
+            if self._dialogBool(title, os.path.basename(existingMacroPath) + message, icon) is not True:
+                return
+        self._createMacro(newMacroName, existingMacroPath)
+
+    def _createMacro(self, newMacroName, existingMacroPath=None):
         """
         Creates a text file and reloads the macro list
         with the new macro as the active macro
         :param newMacroName: The name of the new macro
+        :param existingMacroPath: The path of a macro the user agreed to replace. default is None.
         """
-        # Create Macro
-        self.newMacroPath = self.macroFolderPath + '/' + self.macroPrefix + newMacroName + '.txt'
-        self.newMacroFile = open(self.newMacroPath, 'w')
-        self.newMacroFile.close()
+        # Create Macro, replacing an existing macro keeps its compression
+        if existingMacroPath:
+            self.newMacroPath = existingMacroPath
+        else:
+            self.newMacroPath = (self.macroFolderPath + '/' + self.macroPrefix + newMacroName +
+                                 macroExtensions[getMacroCompression()])
 
-        # Refresh the macro list with the new macro as the active macro
-        self._listMacros()
-        cmds.optionMenu(self.macroOption, e=True, v=newMacroName)
-        self._loadMacroButton()
+        # Refresh the macro list with the new macro as the active macro once it is written
+        self._submitMacroIO(
+            self.newMacroPath,
+            createMacroFile,
+            (self.newMacroPath, existingMacroPath is not None),
+            callback=lambda result: self._listMacros(selectMacro=newMacroName),
+            operation='writeMacro')
 
     def _deleteMacroButton(self, *args):
         """
@@ -584,12 +935,15 @@ class MacroTools:
             return
 
         if confirm == 'Delete':
-            # Delete the active file
-            os.remove(self.activeMacroPath)
+            # Delete the active file once pending writes have finished
+            getMacroIOWorker().wait(self.activeMacroPath)
+            if isSegmentedMacro(self.activeMacroPath):
+                shutil.rmtree(self.activeMacroPath)
+            else:
+                os.remove(self.activeMacroPath)
 
             # Refresh the macro list
             self._listMacros()
-            self._loadMacroButton()
         elif confirm == 'Cancel':
             return
 
@@ -601,7 +955,7 @@ class MacroTools:
         fileName = cmds.fileDialog2(
             dir=self.macroFolderPath,
             fileMode=0,
-            fileFilter='Text Files (*.txt)',
+            fileFilter='Macro Files (*.txt *.txt.gz *.txt.zst)',
             okCaption='OK',
             caption='Select or Create a %s File' % 'New Macro')
         if not fileName:
@@ -633,24 +987,21 @@ class MacroTools:
     #             self._recording(True)
     #             return
 
+    @timedOperation(lambda recording, *args: 'recordingStart' if recording else 'recordingStop')
     def _recording(self, recording, *args):
         """
         Record the script editor output to the active macro or
         Stop recording the script editor output to the active macro
         """
-        # Create a backup before writing to the text file or stopping the recording
-        self._addActiveMacroBackUp()
-
         # Check for an active recording before starting a new one
         if recording is True:
             if self.recording is True:
                 OpenMaya.MGlobal_displayError('A recording is already in progress')
                 return
-            self.recording = True
 
-            # Set the console settings before recording
-            self._saveConsoleSettings()
-            self._setConsoleRecordingSettings()
+            # Create a backup before writing to the text file
+            self._addActiveMacroBackUp()
+            self.recording = True
 
             # Set recording UI state
             self._toggleActiveUI(enable=False)
@@ -658,10 +1009,47 @@ class MacroTools:
             recordButton = wrapInstance(long(omUI.MQtUtil.findControl(self.recordStartButton)), QtWidgets.QPushButton)
             recordButton.setStyleSheet(self.recordingOnStyleSheet)
 
+            # Maya writes to the macro while recording, pending writes must finish first
+            # and the in memory copy is out of date until the recording is loaded again
+            getMacroIOWorker().wait(self.activeMacroPath)
+
+            # Long recordings are split into segments, the macro becomes a folder of segments
+            segmentSize = getRecordingSegmentSize()
+            if segmentSize or isSegmentedMacro(self.activeMacroPath):
+                if not isSegmentedMacro(self.activeMacroPath):
+                    self.activeMacroPath = convertToSegmentedMacro(self.activeMacroPath, segmentSize)
+                    self.macroFiles[self.activeMacro] = os.path.basename(self.activeMacroPath)
+                self.segmentWriter = MacroSegmentWriter(self.activeMacroPath, segmentSize or defaultSegmentSize)
+                self.recordingPath = self.segmentWriter.segmentPath
+
             # Set the active macro to the console readout file
-            cmds.scriptEditorInfo(historyFilename=self.activeMacroPath)
-            print('recording started...')
-            cmds.scriptEditorInfo(writeHistory=True)
+            # Compressed macros are recorded to a plain text file and compressed when the recording stops
+            else:
+                self.recordingPath = self.activeMacroPath
+                if not self.activeMacroPath.endswith(macroExtensions['none']):
+                    self.recordingPath = self.activeMacroPath + '.recording'
+                    writeMacroFile(self.recordingPath, self._getActiveMacroText())
+            self.activeMacroLoaded = False
+
+            # Capture commands through the API, the script editor settings are left untouched
+            if getRecordingBackend() == 'callback':
+                self.commandRecorder = MacroCommandRecorder(self.recordingPath, segmentWriter=self.segmentWriter)
+                self.commandRecorder.start()
+                print('recording started...')
+
+            # Capture the script editor output, set the console settings before recording
+            else:
+                self._saveConsoleSettings()
+                self._setConsoleRecordingSettings()
+                cmds.scriptEditorInfo(historyFilename=self.recordingPath)
+                print('recording started...')
+                cmds.scriptEditorInfo(writeHistory=True)
+
+                # Check the size of the segment every few seconds, Maya does the writing
+                if self.segmentWriter:
+                    self.segmentTimer = QtCore.QTimer()
+                    self.segmentTimer.timeout.connect(self._rotateRecordingSegment)
+                    self.segmentTimer.start(2000)
 
         # Stop recording
         elif recording is False:
@@ -670,8 +1058,27 @@ class MacroTools:
             self.recording = False
 
             # Stop recording
-            cmds.scriptEditorInfo(writeHistory=False)
-            self._resetConsoleSettings()
+            if self.commandRecorder:
+                self.commandRecorder.stop()
+                self.commandRecorder = None
+            else:
+                if self.segmentTimer:
+                    self.segmentTimer.stop()
+                    self.segmentTimer = None
+                cmds.scriptEditorInfo(writeHistory=False)
+                self._resetConsoleSettings()
+
+            # Maya writes script editor recordings itself, so the cache is not told about them
+            invalidateMacroProcedure(self.activeMacroPath)
+            if self.segmentWriter:
+                self.segmentWriter.close()
+                self.segmentWriter = None
+            elif self.recordingPath != self.activeMacroPath:
+                self._submitMacroIO(
+                    self.activeMacroPath,
+                    moveRecordingToMacro,
+                    (self.recordingPath, self.activeMacroPath),
+                    operation='writeMacro')
 
             # Enable UI
             self._toggleActiveUI(enable=True, includeStopButton=False)
@@ -679,8 +1086,8 @@ class MacroTools:
             recordButton.setStyleSheet(self.recordingOffStyleSheet)
             cmds.button(self.recordStopButton, e=True, en=False)
 
-            # Review the recording in the scroll field
-            self._resetMacroScrollField()
+            # Review the recording in the scroll field, the recording is backed up once it is read
+            self._resetMacroScrollField(backUp=True)
 
             print('recording stopped')
 
@@ -712,14 +1119,62 @@ class MacroTools:
         cmds.button(self.macroCopyToClipboardButton, e=True, en=enable)
         cmds.button(self.macroRenameButton, e=True, en=enable)
 
+        # Segmented recordings are played as a stream and can not be edited
+        if enable and isSegmentedMacro(self.activeMacroPath):
+            cmds.button(self.clearMacroButton, e=True, en=False)
+            cmds.button(self.macroEditButton, e=True, en=False)
+            cmds.button(self.macroUndoEditButton, e=True, en=False)
+            cmds.button(self.macroRedoEditButton, e=True, en=False)
+
+    @timedOperation('runMacro')
     def _runMacroButton(self, *args):
         """        # cmds.textField(self.renameNameField)
         # cmds.button(self.renameFinishButton, l='Rename')rename
         Playback the active macro
         """
         print('playing back last recording...' + '\n')
-        mel.eval('source \"' + self.activeMacroPath + '\";')
-        print('playback finished.')
+        startTime = time.time()
+        getMacroIOWorker().wait(self.activeMacroPath)
+
+        playMacro(self.activeMacroPath)
+
+        print('playback finished in %.4fs.' % (time.time() - startTime))
+
+    @timedOperation('iterateMacro')
+    def _iterateMacroButton(self, *args):
+        """
+        Playback the active macro once for each row of a CSV table as a single undo step.
+        The table header names the {{placeholders}} replaced in each iteration.
+        """
+        if not self.activeMacro:
+            OpenMaya.MGlobal_displayError('No macro file is defined')
+            return
+
+        tablePath = cmds.fileDialog2(
+            dir=self.macroFolderPath,
+            fileMode=1,
+            fileFilter='CSV Files (*.csv)',
+            okCaption='Iterate',
+            caption='Select the Iteration Table')
+        if not tablePath:
+            return
+
+        print('iterating ' + self.activeMacro + '...' + '\n')
+        try:
+            rows = readIterationTable(tablePath[0])
+            if isSegmentedMacro(self.activeMacroPath):
+                macroText = readMacroFile(self.activeMacroPath)
+            else:
+                macroText = self._getActiveMacroText()
+            timings = runMacroIterations(macroText, rows, self.activeMacro)
+        except (IOError, OSError, ValueError) as error:
+            OpenMaya.MGlobal_displayError(str(error))
+            return
+
+        for iteration, iterationTime in enumerate(timings['iterations']):
+            print('iteration %d: %.4fs' % (iteration, iterationTime))
+        print('iterating finished. %d iterations, compile %.4fs, total %.4fs' % (
+            len(timings['iterations']), timings['compile'], timings['total']))
 
     def _clearMacroButton(self, *args):
         """
@@ -729,10 +1184,8 @@ class MacroTools:
         self._addActiveMacroBackUp()
 
         # Clear the active macro after confirming with the user
-        with open(self.activeMacroPath) as openMacroFile:
-            if openMacroFile.read():
-                open(self.activeMacroPath, 'w').close()
-                self._resetMacroScrollField()
+        if self._getActiveMacroText():
+            self._saveStringToMacro('')
 
         # Add backup after clearing
         self._addActiveMacroBackUp()
@@ -744,18 +1197,196 @@ class MacroTools:
         macros = []
 
         if os.path.exists(self.macroFolderPath):
+            self.macroFolderModifiedTime = os.path.getmtime(self.macroFolderPath)
             items = os.listdir(self.macroFolderPath)
+            recordFileSystemCall(3 + len(items))
             for i in items:
-                # Only collect items which are text files and have the macro prefix
-                if os.path.isfile(self.macroFolderPath + '/' + i):
-                    if i.startswith(self.macroPrefix) and i.endswith('.txt'):
+                # Only collect items which are text files, or segmented macro folders, and have the macro prefix
+                if i.endswith(segmentedMacroExtension):
+                    if i.startswith(self.macroPrefix) and os.path.isdir(self.macroFolderPath + '/' + i):
+                        macros.append(i)
+                elif os.path.isfile(self.macroFolderPath + '/' + i):
+                    if i.startswith(self.macroPrefix) and isMacroFile(i):
                         macros.append(i)
 
         return macros
 
-    def _listMacros(self, *args):
+    def _toggleRecordingBackend(self, useCallbacks, *args):
+        """
+        Choose between recording the script editor output and recording commands through API callbacks.
+        :param useCallbacks: True to record with command callbacks
+        """
+        if self.recording:
+            OpenMaya.MGlobal_displayError('The recording method can not change while recording')
+            return
+        cmds.optionVar(sv=('MacroToolsRecordingBackend', 'callback' if useCallbacks else 'scriptEditor'))
+
+    def _toggleRecordingSegments(self, segmentRecordings, *args):
+        """
+        Turn splitting new recordings into fixed size segments on or off.
+        :param segmentRecordings: True to record into segments
+        """
+        if self.recording:
+            OpenMaya.MGlobal_displayError('Segmenting can not change while recording')
+            return
+        cmds.optionVar(iv=('MacroToolsSegmentSize', defaultSegmentSize if segmentRecordings else 0))
+
+    def _validateSegmentsButton(self, *args):
+        """
+        Check the segments of the active macro against its manifest and report any problems.
+        """
+        if not isSegmentedMacro(self.activeMacroPath):
+            OpenMaya.MGlobal_displayError('The active macro is not segmented')
+            return
+
+        problems = validateSegmentedMacro(self.activeMacroPath)
+        for problem in problems:
+            OpenMaya.MGlobal_displayWarning(problem)
+        if not problems:
+            print(self.activeMacro + ' is valid.')
+
+    def _rotateRecordingSegment(self, *args):
+        """
+        Start a new segment once the script editor has filled the current one.
+        """
+        if not self.segmentWriter or not self.segmentWriter.isFull():
+            return
+        cmds.scriptEditorInfo(writeHistory=False)
+        cmds.scriptEditorInfo(historyFilename=self.segmentWriter.rotate())
+        cmds.scriptEditorInfo(writeHistory=True)
+
+    def _convertMacrosButton(self, compression, *args):
+        """
+        Convert every macro in the folder to a compression and report the difference.
+        New macros are created with the same compression.
+        :param compression: 'none', 'gzip' or 'zstd'
+        """
+        getMacroIOWorker().wait()
+        report = convertMacroFolder(self.macroFolderPath, compression, self.macroPrefix)
+        failed = [entry for entry in report if 'error' in entry]
+        report = [entry for entry in report if 'error' not in entry]
+        for entry in failed:
+            cmds.warning('Could not convert macro "' + entry['macro'] + '": ' + entry['error'])
+
+        # Only create new macros with the compression once it is known to work
+        if report or not failed:
+            cmds.optionVar(sv=('MacroToolsCompression', compression))
+        else:
+            OpenMaya.MGlobal_displayError('No macros could be converted to ' + compression +
+                                          ', new macros keep the previous compression')
+
+        bytesBefore = sum(entry['bytesBefore'] for entry in report)
+        bytesAfter = sum(entry['bytesAfter'] for entry in report)
+        loadBefore = sum(entry['loadBefore'] for entry in report)
+        loadAfter = sum(entry['loadAfter'] for entry in report)
+        print('%d macros converted to %s. %d bytes saved, load time %.4fs before and %.4fs after' % (
+            len(report), compression, bytesBefore - bytesAfter, loadBefore, loadAfter))
+
+        # The active macro file was replaced
+        if self.activeMacro:
+            self.activeMacroPath = findMacroPath(self.macroFolderPath, self.activeMacro, self.macroPrefix)
+        self._listMacros(selectMacro=self.activeMacro, loadMacro=False)
+
+    def _buildPlaylistMenu(self, *args):
+        """
+        Refresh the playlist menu with a create item and a run item for each playlist.
+        The menu shows the last listing straight away and is updated when the folder is listed again.
+        """
+        self._fillPlaylistMenu()
+        self._submitMacroIO(
+            self.macroFolderPath,
+            listPlaylists,
+            (self.macroFolderPath,),
+            callback=partial(self._playlistsListed, self.macroFolderPath),
+            operation='listPlaylists')
+
+    def _playlistsListed(self, macroFolderPath, playlists):
+        """
+        Update the playlist menu if the playlists changed since the last listing.
+        """
+        if macroFolderPath == self.macroFolderPath and playlists != self.playlists:
+            self.playlists = playlists
+            self._fillPlaylistMenu()
+
+    def _fillPlaylistMenu(self):
+        cmds.menu(self.playlistMenu, e=True, deleteAllItems=True)
+        cmds.menuItem(l='Create Playlist...', p=self.playlistMenu, c=self._createPlaylistButton)
+        cmds.menuItem(divider=True, p=self.playlistMenu)
+
+        if self.playlists is None:
+            cmds.menuItem(l='Loading...', en=False, p=self.playlistMenu)
+        elif not self.playlists:
+            cmds.menuItem(l='No Playlists', en=False, p=self.playlistMenu)
+        else:
+            for playlist in self.playlists:
+                cmds.menuItem(l=playlist, p=self.playlistMenu, c=partial(self._runPlaylistButton, playlist))
+
+    def _createPlaylistButton(self, *args):
+        """
+        Ask for a playlist name and its macros then save the playlist to the macro folder.
+        """
+        result = cmds.promptDialog(
+            title='Create Playlist',
+            message='Playlist Name',
+            button=['OK', 'Cancel'],
+            defaultButton='OK',
+            cancelButton='Cancel',
+            dismissString='Cancel')
+        if result != 'OK':
+            return
+        playlistName = cmds.promptDialog(q=True, text=True)
+        if not playlistName:
+            OpenMaya.MGlobal_displayError('No playlist name is defined')
+            return
+
+        result = cmds.promptDialog(
+            title='Create Playlist',
+            message='Macros to run in order, separated by commas',
+            text=self.activeMacro,
+            button=['OK', 'Cancel'],
+            defaultButton='OK',
+            cancelButton='Cancel',
+            dismissString='Cancel')
+        if result != 'OK':
+            return
+        macros = [macro.strip() for macro in cmds.promptDialog(q=True, text=True).split(',') if macro.strip()]
+
+        # Write in the background, the next time the menu opens it lists the new playlist
+        playlistPath = self.macroFolderPath + '/' + playlistName + playlistExtension
+        self._submitMacroIO(playlistPath, writePlaylist, (playlistPath, macros), operation='writePlaylist')
+
+    def _runPlaylistButton(self, playlistName, *args):
+        """
+        Playback all macros in a playlist as a single undo step.
+        :param playlistName: The name of the playlist without the extension
+        """
+        print('playing back playlist ' + playlistName + '...' + '\n')
+        getMacroIOWorker().wait()
+        try:
+            timings = runPlaylist(self.macroFolderPath, playlistName, self.macroPrefix)
+        except (IOError, OSError, ValueError) as error:
+            OpenMaya.MGlobal_displayError(str(error))
+            return
+
+        print('playlist finished. ' + ', '.join('%s %.3fs' % (stage, timings[stage]) for stage in playlistStages))
+
+    @timedOperation('listMacros')
+    def _listMacros(self, selectMacro=None, loadMacro=True, *args):
         """
         Refresh the option menu to show all available macros.
+        The folder is listed in the background and the menu is updated when the listing arrives.
+        :param selectMacro: The macro to select once the list is refreshed. default is None.
+        :param loadMacro: Load the selected macro once the list is refreshed. default is True.
+        """
+        self._submitMacroIO(
+            self.macroFolderPath,
+            self._getMacros,
+            callback=partial(self._updateMacroList, selectMacro, loadMacro),
+            operation='getMacros')
+
+    def _updateMacroList(self, selectMacro, loadMacro, macros):
+        """
+        Fill the option menu with a listing of the macro folder.
         """
         # Clear the option menu before updating
         items = cmds.optionMenu(self.macroOption, q=True, ill=True)
@@ -763,18 +1394,22 @@ class MacroTools:
             cmds.deleteUI(items)
 
         # Create a new list of macros with short names.
-        macros = self._getMacros()
+        self.macroFiles = {}
         if len(macros):
             cmds.menuItem('Select Macro', p=self.macroOption)
             for macro in macros:
-                if self.macroPrefix:
-                    trimmedMacroName = (macro.split(self.macroPrefix))[1].split(".txt")[0]
-                else:
-                    trimmedMacroName = macro.split(".txt")[0]
+                trimmedMacroName = macroNameFromFile(macro, self.macroPrefix)
+                self.macroFiles[trimmedMacroName] = macro
                 cmds.menuItem(trimmedMacroName, p=self.macroOption)
         else:
             cmds.menuItem('No Macros', p=self.macroOption)
 
+        if selectMacro in self.macroFiles:
+            cmds.optionMenu(self.macroOption, e=True, v=selectMacro)
+        if loadMacro:
+            self._loadMacroButton()
+
+    @timedOperation('loadMacro')
     def _loadMacroButton(self, *args):
         """
         Load the name of the selected macro then show the macro in the scroll field.
@@ -785,7 +1420,10 @@ class MacroTools:
 
         if cmds.optionMenu(self.macroOption, q=True, sl=True) != 1:
             self.activeMacro = cmds.optionMenu(self.macroOption, q=True, v=True)
-            self.activeMacroPath = self.macroFolderPath + '/' + self.macroPrefix + self.activeMacro + ".txt"
+            if self.activeMacro in self.macroFiles:
+                self.activeMacroPath = self.macroFolderPath + '/' + self.macroFiles[self.activeMacro]
+            else:
+                self.activeMacroPath = findMacroPath(self.macroFolderPath, self.activeMacro, self.macroPrefix)
             self._resetMacroScrollField()
 
             # Clear any backups from previous active macro and add an initial backup
@@ -811,40 +1449,137 @@ class MacroTools:
         """
         Add a new macro back up here, only add unique entries
         """
-        with open(self.activeMacroPath) as openMacroFile:
-            # Get the contents of the macro
-            newBackUp = openMacroFile.read()
-
-            # If there are already backups, check if the previous back
-            # up is the same as the new one and add the new backup
-            if len(self.activeMacroBackUps) != 0:
-                previousBackUp = ''.join(map(str, self.activeMacroBackUps[-1:]))
-                if previousBackUp != newBackUp and newBackUp is not False:
-                    self.activeMacroBackUps.append(newBackUp)
-                    self.backUpsIndex += 1
-                    self._updateUndoRedoButtonStates()
-
-            # If there are no other back ups and this one isn't empty add the new backup
-            elif newBackUp is not False:
+        # Segmented macros can not be edited so they have no backups
+        if isSegmentedMacro(self.activeMacroPath):
+            return
+
+        # Get the contents of the macro
+        newBackUp = self._getActiveMacroText()
+
+        # If there are already backups, check if the previous back
+        # up is the same as the new one and add the new backup
+        if len(self.activeMacroBackUps) != 0:
+            previousBackUp = ''.join(map(str, self.activeMacroBackUps[-1:]))
+            if previousBackUp != newBackUp and newBackUp is not False:
                 self.activeMacroBackUps.append(newBackUp)
                 self.backUpsIndex += 1
                 self._updateUndoRedoButtonStates()
 
-    def _resetMacroScrollField(self):
+        # If there are no other back ups and this one isn't empty add the new backup
+        elif newBackUp is not False:
+            self.activeMacroBackUps.append(newBackUp)
+            self.backUpsIndex += 1
+            self._updateUndoRedoButtonStates()
+
+    def _resetMacroScrollField(self, backUp=False):
         """
         Load the active macro to the macroScrollField, disable
         the scroll field and create a backup of the macro
+        The macro is read in the background, the scroll field shows it is loading until then.
+        :param backUp: Add the macro to the backups once it is read. default is False.
+        """
+        self.activeMacroLoaded = False
+        self.activeMacroVersion += 1
+        cmds.scrollField(
+            self.macroScrollField,
+            e=True,
+            editable=False,
+            backgroundColor=self.scrollFieldIDisabledBGColor,
+            text='// Loading ' + self.activeMacro + '...')
+
+        # Segmented macros only show a preview so they are never read into memory at once
+        readFunction = readMacroFileWithModifiedTime
+        if isSegmentedMacro(self.activeMacroPath):
+            readFunction = readSegmentedMacroPreview
+
+        self._submitMacroIO(
+            self.activeMacroPath,
+            readFunction,
+            (self.activeMacroPath,),
+            callback=partial(self._macroTextLoaded, self.activeMacroPath, self.activeMacroVersion, backUp),
+            operation='readMacro')
+
+    def _macroTextLoaded(self, macroPath, version, backUp, result):
+        """
+        Show a macro read in the background, unless another macro was loaded or it was changed since.
+        """
+        if macroPath != self.activeMacroPath or version != self.activeMacroVersion:
+            return
+        macroText, self.activeMacroModifiedTime = result
+        self.activeMacroText = macroText
+        self.activeMacroLoaded = True
+        if backUp:
+            self._addActiveMacroBackUp()
+        self._showMacroText(macroText)
+
+    def _macroWritten(self, macroPath, modifiedTime):
+        """
+        Remember the modified time of the active macro after a background write.
         """
-        with open(self.activeMacroPath) as openMacroFile:
-            macroText = openMacroFile.read()
-            self.macroBackUp = macroText
+        if macroPath == self.activeMacroPath:
+            self.activeMacroModifiedTime = modifiedTime
 
-            cmds.scrollField(
-                self.macroScrollField,
-                e=True,
-                editable=False,
-                backgroundColor=self.scrollFieldIDisabledBGColor,
-                text=macroText)
+    def _showMacroText(self, macroText):
+        """
+        Show the text in the disabled macroScrollField.
+        """
+        self.macroBackUp = macroText
+
+        cmds.scrollField(
+            self.macroScrollField,
+            e=True,
+            editable=False,
+            backgroundColor=self.scrollFieldIDisabledBGColor,
+            text=macroText)
+
+    def _getActiveMacroText(self):
+        """
+        Return the contents of the active macro.
+        If it is still being read, or was changed by a recording, wait for it instead.
+        """
+        if not self.activeMacroLoaded:
+            getMacroIOWorker().wait(self.activeMacroPath)
+            self.activeMacroText = readMacroFile(self.activeMacroPath)
+            self.activeMacroLoaded = True
+        return self.activeMacroText
+
+    def _submitMacroIO(self, key, function, args=(), callback=None, operation='io'):
+        """
+        Run a file operation in the background and pass its result to the callback on the main thread.
+        Operations with the same key, the file or folder path, run in the order they were submitted.
+        Maya commands can only run on the main thread, so the function must not use cmds or mel.
+        """
+        self.pendingIOCount += 1
+        self._updatePendingState()
+
+        def finished(result, error):
+            self.pendingIOCount -= 1
+            # The window may have been closed while waiting
+            if not cmds.window(self.window, exists=True):
+                return
+            self._updatePendingState()
+            if error is not None:
+                OpenMaya.MGlobal_displayError(str(error))
+            elif callback:
+                callback(result)
+
+        # Background work is recorded under the operation that started it, for example loadMacro/readMacro,
+        # as that operation itself only times handing the work over
+        activeOperations = _getActiveOperations()
+        if activeOperations:
+            operation = activeOperations[-1]['operation'] + '/' + operation
+        getMacroIOWorker().submit(key, function, args, finished, operation, self.macroFolderPath)
+
+    def _updatePendingState(self):
+        """
+        Show in the window title when file operations are still running.
+        """
+        if not cmds.window(self.window, exists=True):
+            return
+        if self.pendingIOCount > 0:
+            cmds.window(self.window, e=True, t=self.windowName + ' - Working...')
+        else:
+            cmds.window(self.window, e=True, t=self.windowName)
 
 
     @staticmethod
@@ -917,4 +1652,1356 @@ class MacroTools:
         elif value > max:
             return max
         else:
-            return value
\ No newline at end of file
+            return value
+
+# Remote Execution
+# Macros can be run from outside of Maya by opening a command port with openMacroCommandPort()
+# and sending requests with the MacroToolsClient module.
+
+commandPortBufferSize = 65536  # Maya's default of 4096 characters only fits a few requests
+remoteErrorLength = 200
+
+
+def openMacroCommandPort(port=7002, bufferSize=commandPortBufferSize):
+    """
+    Open a python command port that remote clients can use to run macros.
+    Maya answers each buffer it receives once, so the client sends one call per buffer and
+    bufferSize limits the size of a call and its result.
+    :param port: The port to listen on. default is 7002.
+    :param bufferSize: The size of the command and result buffers. default is 65536.
+    :return: The name of the command port
+    """
+    portName = ':' + str(port)
+    if not cmds.commandPort(portName, q=True):
+        cmds.commandPort(name=portName, sourceType='python', echoOutput=False, noreturn=False,
+                         bufferSize=bufferSize)
+    print('MacroTools command port open on ' + portName)
+    return portName
+
+
+def closeMacroCommandPort(port=7002):
+    """
+    Close a command port opened with openMacroCommandPort.
+    :param port: The port to close. default is 7002.
+    """
+    portName = ':' + str(port)
+    if cmds.commandPort(portName, q=True):
+        cmds.commandPort(name=portName, close=True)
+
+
+def substituteMacroParameters(macroText, parameters=None):
+    """
+    Replace {{name}} placeholder tokens in a macro with parameter values.
+    :param macroText: The macro contents
+    :param parameters: A dictionary of placeholder names and values. default is None.
+    :return: The macro contents with the placeholders replaced
+    """
+    if not parameters:
+        return macroText
+    for name, value in parameters.items():
+        macroText = macroText.replace('{{' + str(name) + '}}', str(value))
+    return macroText
+
+
+def remoteRunMacro(request):
+    """
+    Run a macro from the macro folder on behalf of a remote client.
+    The request and the result are JSON strings so they can pass through a command port.
+    :param request: JSON with the keys id, macro and optionally parameters
+    :return: JSON with the keys id, macro, success, error and timings
+    """
+    startTime = time.time()
+    result = {'id': None, 'macro': None, 'success': False, 'error': None, 'timings': {}}
+
+    try:
+        request = json.loads(request)
+        result['id'] = request.get('id')
+        result['macro'] = request.get('macro')
+
+        # Read the macro from the macro folder saved in the preferences
+        macroFolderPath = cmds.optionVar(q='MacroToolsDirectory')
+        macroPath = findMacroPath(macroFolderPath, request['macro'])
+        parameters = request.get('parameters')
+        if parameters:
+            macroCommand = substituteMacroParameters(readMacroFile(macroPath), parameters)
+        else:
+            macroCommand = None
+        readTime = time.time()
+
+        # Run the macro as a single undo step, without parameters the playback cache is used
+        cmds.undoInfo(openChunk=True, chunkName='MacroTools_' + request['macro'])
+        try:
+            if macroCommand is None:
+                playMacro(macroPath)
+            else:
+                mel.eval(macroCommand)
+        finally:
+            cmds.undoInfo(closeChunk=True)
+        executeTime = time.time()
+
+        result['success'] = True
+        result['timings'] = {'read': readTime - startTime, 'execute': executeTime - readTime}
+    except Exception as error:
+        result['error'] = str(error)
+
+    result['timings']['total'] = time.time() - startTime
+    return json.dumps(result)
+
+
+def remoteRunMacros(requests):
+    """
+    Run several macros on behalf of a remote client in a single command port call.
+    Maya sends one response for each buffer it receives, so a batch of requests is sent as one
+    JSON list and answered with one JSON list.
+    :param requests: JSON list of requests in the format used by remoteRunMacro
+    :return: JSON list of results in the same order as the requests
+    """
+    results = []
+    for request in json.loads(requests):
+        result = json.loads(remoteRunMacro(json.dumps(request)))
+        # Long errors are cut short so the results still fit in the command port buffer
+        if result['error'] and len(result['error']) > remoteErrorLength:
+            result['error'] = result['error'][:remoteErrorLength] + '...'
+        results.append(result)
+    return json.dumps(results)
+
+
+# Playlists
+# A playlist is a text file in the macro folder with one macro name per line.
+# All macros in a playlist are compiled into one MEL script that is cached until a member changes.
+
+playlistExtension = '.playlist'
+playlistStages = ('load', 'validate', 'compile', 'execute', 'total')
+_playlistCache = {}
+
+
+def readPlaylist(playlistPath):
+    """
+    Return the macro names in a playlist, skipping blank lines and # comments.
+    :param playlistPath: The path to the playlist file
+    """
+    with open(playlistPath) as openPlaylistFile:
+        lines = [line.strip() for line in openPlaylistFile]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def writePlaylist(playlistPath, macros):
+    """
+    Write a playlist with one macro name per line.
+    :param playlistPath: The path to the playlist file
+    :param macros: The macro names in the order they run
+    """
+    recordFileSystemCall()
+    with open(playlistPath, 'w') as openPlaylistFile:
+        openPlaylistFile.write('\n'.join(macros) + '\n')
+
+
+def listPlaylists(macroFolderPath):
+    """
+    Return the sorted names of the playlists in a macro folder.
+    """
+    playlists = []
+    recordFileSystemCall()
+    if os.path.exists(macroFolderPath):
+        recordFileSystemCall()
+        for fileName in os.listdir(macroFolderPath):
+            if fileName.endswith(playlistExtension):
+                playlists.append(fileName[:-len(playlistExtension)])
+    return sorted(playlists)
+
+
+def compilePlaylist(macroFolderPath, playlistName, macroPrefix=''):
+    """
+    Load, validate and concatenate the macros of a playlist into one MEL script.
+    The script is cached and only compiled again when the playlist or a member macro is modified.
+    :param macroFolderPath: The folder holding the playlist and its macros
+    :param playlistName: The name of the playlist without the extension
+    :param macroPrefix: The prefix of the macro files. default is no prefix.
+    :return: The compiled MEL script and a dictionary of timings per stage
+    """
+    timings = dict.fromkeys(playlistStages, 0.0)
+    startTime = time.time()
+
+    playlistPath = macroFolderPath + '/' + playlistName + playlistExtension
+    macros = readPlaylist(playlistPath)
+    macroPaths = [findMacroPath(macroFolderPath, macro, macroPrefix) for macro in macros]
+
+    # Validate, every member has to exist. The modified times are the key of the cache
+    missing = [macro for macro, macroPath in zip(macros, macroPaths) if not os.path.exists(macroPath)]
+    if not macros:
+        raise ValueError('Playlist "' + playlistName + '" is empty')
+    if missing:
+        raise ValueError('Playlist "' + playlistName + '" is missing macros: ' + ', '.join(missing))
+    signature = tuple([os.path.getmtime(playlistPath)] + [os.path.getmtime(macroPath) for macroPath in macroPaths])
+    timings['validate'] = time.time() - startTime
+
+    cached = _playlistCache.get(playlistPath)
+    if cached and cached[0] == signature:
+        return cached[1], timings
+
+    # Load every member once
+    loadStart = time.time()
+    macroTexts = []
+    for macroPath in macroPaths:
+        macroTexts.append(readMacroFile(macroPath))
+    timings['load'] = time.time() - loadStart
+
+    # Concatenate into one script, marking where each macro starts. Each macro is its own block
+    # so variables declared in one macro do not clash with the next, as when they are played alone.
+    # Procedures can only be defined at the top level, so macros that define them are not wrapped.
+    compileStart = time.time()
+    compiledMacros = []
+    for macro, macroText in zip(macros, macroTexts):
+        macroText = macroText.rstrip('\n') + '\n'
+        if not procedureDefinitionPattern.search(macroText):
+            macroText = '{\n' + macroText + '}\n'
+        compiledMacros.append('// MacroTools playlist: ' + macro + '\n' + macroText)
+    compiled = ''.join(compiledMacros)
+    timings['compile'] = time.time() - compileStart
+
+    _playlistCache[playlistPath] = (signature, compiled)
+    return compiled, timings
+
+
+def runPlaylist(macroFolderPath, playlistName, macroPrefix=''):
+    """
+    Run a playlist as one execution inside a single undo chunk.
+    :param macroFolderPath: The folder holding the playlist and its macros
+    :param playlistName: The name of the playlist without the extension
+    :param macroPrefix: The prefix of the macro files. default is no prefix.
+    :return: A dictionary of timings per stage
+    """
+    startTime = time.time()
+    compiled, timings = compilePlaylist(macroFolderPath, playlistName, macroPrefix)
+
+    executeStart = time.time()
+    cmds.undoInfo(openChunk=True, chunkName='MacroTools_' + playlistName)
+    try:
+        mel.eval(compiled)
+    finally:
+        cmds.undoInfo(closeChunk=True)
+    timings['execute'] = time.time() - executeStart
+    timings['total'] = time.time() - startTime
+
+    return timings
+
+
+# Macro Storage
+# Macros are plain text files that can optionally be compressed with gzip, or zstandard when it is installed.
+# Reading and writing macros goes through these functions so compression is transparent to the tool.
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+macroExtensions = {'none': '.txt', 'gzip': '.txt.gz', 'zstd': '.txt.zst'}
+macroStreamChunkSize = 65536
+macroEncoding = 'utf-8'
+temporaryMacroExtension = '.tmp'
+
+
+def getMacroCompression():
+    """
+    Return the compression used for new macros from the preferences.
+    """
+    compression = 'none'
+    if cmds.optionVar(exists='MacroToolsCompression'):
+        compression = cmds.optionVar(q='MacroToolsCompression')
+    if compression not in macroExtensions or (compression == 'zstd' and zstandard is None):
+        compression = 'none'
+    return compression
+
+
+def splitMacroExtension(fileName):
+    """
+    Split a macro file name into the name and the macro extension.
+    :return: The name and extension, the extension is empty if the file is not a macro
+    """
+    for extension in list(macroExtensions.values()) + [segmentedMacroExtension]:
+        if fileName.endswith(extension):
+            return fileName[:-len(extension)], extension
+    return fileName, ''
+
+
+def isMacroFile(fileName):
+    """
+    Return True if the file name has a macro extension that can be read.
+    """
+    extension = splitMacroExtension(fileName)[1]
+    if extension == macroExtensions['zstd']:
+        return zstandard is not None
+    return extension != ''
+
+
+def macroNameFromFile(fileName, macroPrefix=''):
+    """
+    Return the short macro name of a macro file without the prefix and extension.
+    """
+    macroName = splitMacroExtension(fileName)[0]
+    if macroPrefix and macroName.startswith(macroPrefix):
+        macroName = macroName[len(macroPrefix):]
+    return macroName
+
+
+def findMacroPath(macroFolderPath, macroName, macroPrefix=''):
+    """
+    Return the path of a macro in any of the supported compressions.
+    If the macro does not exist yet return a path using the preferred compression.
+    Reads the preferences, so only call it from the main thread.
+    """
+    macroPath = findExistingMacroPath(macroFolderPath, macroName, macroPrefix)
+    if macroPath is None:
+        macroPath = macroFolderPath + '/' + macroPrefix + macroName + macroExtensions[getMacroCompression()]
+    return macroPath
+
+
+def findExistingMacroPath(macroFolderPath, macroName, macroPrefix=''):
+    """
+    Return the path of a macro in any of the supported compressions, or None if it does not exist.
+    Only touches the file system, so it can run on the background threads.
+    """
+    basePath = macroFolderPath + '/' + macroPrefix + macroName
+    for compression in ('none', 'gzip', 'zstd'):
+        recordFileSystemCall()
+        if os.path.isfile(basePath + macroExtensions[compression]):
+            return basePath + macroExtensions[compression]
+    recordFileSystemCall()
+    if os.path.isdir(basePath + segmentedMacroExtension):
+        return basePath + segmentedMacroExtension
+    return None
+
+
+def openMacroStream(macroPath, errors='replace'):
+    """
+    Open a macro for reading as text, compressed macros are decompressed as they are read.
+    Every macro is decoded as UTF-8 whatever its compression.
+    The bytes read from disk, before decompression, are added to the operation metrics.
+    :param errors: How undecodable bytes are handled, 'strict' raises. default is 'replace'.
+    """
+    extension = splitMacroExtension(macroPath)[1]
+    recordFileSystemCall()
+    if extension == segmentedMacroExtension:
+        return SegmentedMacroStream(getMacroSegments(macroPath), errors)
+
+    sourceFile = _CountingReader(macroPath)
+    if extension == macroExtensions['gzip']:
+        # TextIOWrapper needs read1, which GzipFile does not have in Python 2
+        rawStream = io.BufferedReader(gzip.GzipFile(fileobj=sourceFile, mode='rb'))
+    elif extension == macroExtensions['zstd']:
+        rawStream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(sourceFile))
+    else:
+        rawStream = io.BufferedReader(sourceFile)
+    macroStream = _MacroTextStream(rawStream, encoding=macroEncoding, errors=errors)
+    macroStream.sourceFile = sourceFile
+    return macroStream
+
+
+class _CountingReader(io.RawIOBase):
+    """
+    A binary file that adds the bytes read from it to the operation metrics.
+    """
+
+    def __init__(self, filePath):
+        self.openFile = io.open(filePath, 'rb', buffering=0)
+
+    def readable(self):
+        return True
+
+    # GzipFile in Python 2 seeks in the compressed file while reading it
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.openFile.seek(offset, whence)
+
+    def tell(self):
+        return self.openFile.tell()
+
+    def readinto(self, buffer):
+        size = self.openFile.readinto(buffer)
+        if size:
+            recordFileSystemCall(calls=0, bytesRead=size)
+        return size
+
+    def close(self):
+        self.openFile.close()
+        io.RawIOBase.close(self)
+
+
+class _MacroTextStream(io.TextIOWrapper):
+    """
+    A text stream that also closes the file underneath a decompressor, which GzipFile leaves open.
+    """
+    sourceFile = None
+
+    def close(self):
+        try:
+            io.TextIOWrapper.close(self)
+        finally:
+            if self.sourceFile is not None:
+                self.sourceFile.close()
+
+
+def readMacroFile(macroPath, errors='replace'):
+    """
+    Return the contents of a macro, reading compressed macros in chunks.
+    :param errors: How undecodable bytes are handled, 'strict' raises. default is 'replace'.
+    """
+    chunks = []
+    openMacroFile = openMacroStream(macroPath, errors)
+    try:
+        while True:
+            chunk = openMacroFile.read(macroStreamChunkSize)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        openMacroFile.close()
+    return u''.join(chunks)
+
+
+def writeMacroFile(macroPath, macroText):
+    """
+    Write the contents of a macro as UTF-8, compressing it if the extension asks for it.
+    The macro is written to a temporary file first and then replaces the old one, so a failed
+    write never leaves a broken macro behind.
+    """
+    macroBytes = _toMacroText(macroText).encode(macroEncoding)
+
+    extension = splitMacroExtension(macroPath)[1]
+    if extension == macroExtensions['gzip']:
+        macroBytes = gzip.compress(macroBytes) if hasattr(gzip, 'compress') else _gzipCompress(macroBytes)
+    elif extension == macroExtensions['zstd']:
+        macroBytes = zstandard.ZstdCompressor().compress(macroBytes)
+
+    temporaryPath = macroPath + temporaryMacroExtension
+    recordFileSystemCall(calls=2, bytesWritten=len(macroBytes))
+    try:
+        with open(temporaryPath, 'wb') as openMacroFile:
+            openMacroFile.write(macroBytes)
+        MacroToolsSync.replaceFile(temporaryPath, macroPath)
+    except Exception:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+    finally:
+        invalidateMacroProcedure(macroPath)
+
+
+def createMacroFile(macroPath, overwrite=False):
+    """
+    Create an empty macro.
+    :param overwrite: Replace the macro if it exists. default is False, an existing macro raises an IOError.
+    """
+    recordFileSystemCall()
+    if not overwrite and os.path.exists(macroPath):
+        raise IOError('Macro "' + os.path.basename(macroPath) + '" already exists')
+    writeMacroFile(macroPath, '')
+
+
+def moveRecordingToMacro(recordingPath, macroPath):
+    """
+    Write a plain text recording to a compressed macro and remove the recording.
+    """
+    writeMacroFile(macroPath, readMacroFile(recordingPath))
+    recordFileSystemCall()
+    os.remove(recordingPath)
+
+
+def appendMacroFile(macroPath, macroText):
+    """
+    Append text to a plain text macro or recording as UTF-8.
+    """
+    with io.open(macroPath, 'a', encoding=macroEncoding) as openMacroFile:
+        openMacroFile.write(_toMacroText(macroText))
+    invalidateMacroProcedure(macroPath)
+
+
+def _toMacroText(macroText):
+    # Python 2 str from Maya or the UI is decoded so every macro is encoded the same way
+    if isinstance(macroText, bytes):
+        return macroText.decode(macroEncoding, 'replace')
+    return macroText
+
+
+def _gzipCompress(data):
+    # gzip.compress does not exist in Python 2
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as openBuffer:
+        openBuffer.write(data)
+    return buffer.getvalue()
+
+
+def readMacroFileWithModifiedTime(macroPath):
+    """
+    Return the contents of a macro and its modified time.
+    """
+    macroText = readMacroFile(macroPath)
+    recordFileSystemCall()
+    return macroText, os.path.getmtime(macroPath)
+
+
+def writeMacroFileWithModifiedTime(macroPath, macroText):
+    """
+    Write the contents of a macro and return its new modified time.
+    """
+    writeMacroFile(macroPath, macroText)
+    recordFileSystemCall()
+    return os.path.getmtime(macroPath)
+
+
+def getModifiedTime(path):
+    """
+    Return the modified time of a file or folder, or None if it does not exist.
+    """
+    recordFileSystemCall()
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def convertMacroFolder(macroFolderPath, compression, macroPrefix=''):
+    """
+    Rewrite every macro in a folder with a different compression.
+    :param macroFolderPath: The folder holding the macros
+    :param compression: 'none', 'gzip' or 'zstd'
+    :param macroPrefix: The prefix of the macro files. default is no prefix.
+    :return: A list with the name, bytes and load time before and after for each converted macro,
+             macros that could not be converted only have the name and the error
+    """
+    report = []
+    newExtension = macroExtensions[compression]
+
+    for fileName in sorted(os.listdir(macroFolderPath)):
+        oldPath = macroFolderPath + '/' + fileName
+        macroName, extension = splitMacroExtension(fileName)
+        if not fileName.startswith(macroPrefix) or not isMacroFile(fileName) or extension == newExtension:
+            continue
+        if extension == segmentedMacroExtension:
+            continue
+
+        # Write the new file before removing the old one so a failure never loses a macro.
+        # A macro that can not be converted is skipped and left as it is.
+        newPath = macroFolderPath + '/' + macroName + newExtension
+        try:
+            startTime = time.time()
+            macroText = readMacroFile(oldPath, errors='strict')
+            loadBefore = time.time() - startTime
+
+            writeMacroFile(newPath, macroText)
+            startTime = time.time()
+            if readMacroFile(newPath, errors='strict') != macroText:
+                raise ValueError('the converted macro does not read back the same')
+            loadAfter = time.time() - startTime
+        except Exception as error:
+            if os.path.exists(newPath) and os.path.exists(oldPath):
+                os.remove(newPath)
+            report.append({'macro': macroName, 'error': str(error)})
+            continue
+
+        report.append({
+            'macro': macroName,
+            'bytesBefore': os.path.getsize(oldPath),
+            'bytesAfter': os.path.getsize(newPath),
+            'loadBefore': loadBefore,
+            'loadAfter': loadAfter})
+        os.remove(oldPath)
+
+    return report
+
+
+# Command Recording
+# Records executed MEL commands through an API callback instead of the script editor history.
+# Commands that can not be replayed are dropped as they arrive and the rest are written in batches.
+
+# Commands that only query or update the interface
+nonReplayableCommands = set([
+    'about', 'attributeQuery', 'autoUpdateAttrEd', 'buildObjectMenuItemsNow', 'button', 'changeToolIcon',
+    'checkBox', 'editMenuUpdate', 'exists', 'filetest', 'formLayout', 'frameLayout', 'getAttr',
+    'headsUpDisplay', 'isTrue', 'ls', 'menu', 'menuItem', 'objExists', 'optionMenu', 'optionVar',
+    'scriptEditorInfo', 'scrollField', 'showWindow', 'statusLineUpdate', 'textField', 'toolPropertyWindow',
+    'undoInfo', 'updateAE', 'whatIs', 'window', 'windowPref'])
+nonReplayablePrefixes = ('dR_',)
+recordTimePrefix = 't='  # Recorded commands end with a comment like "// t=1.250", the seconds since the start
+queryFlagPattern = re.compile(r'\s-(q|query)(\s|$)')
+
+
+def getRecordingBackend():
+    """
+    Return the recording backend from the preferences, 'scriptEditor' or 'callback'.
+    """
+    if cmds.optionVar(exists='MacroToolsRecordingBackend'):
+        if cmds.optionVar(q='MacroToolsRecordingBackend') == 'callback':
+            return 'callback'
+    return 'scriptEditor'
+
+
+def isReplayableCommand(command):
+    """
+    Return True if a command changes the scene and should be kept in a recording.
+    """
+    command = command.strip()
+    if not command or command.startswith('//'):
+        return False
+    # Commands run by MacroTools itself
+    if 'MacroTools' in command:
+        return False
+    commandName = re.split(r'[\s(;]', command, 1)[0]
+    if commandName in nonReplayableCommands or commandName.startswith(nonReplayablePrefixes):
+        return False
+    return not queryFlagPattern.search(command)
+
+
+class MacroCommandRecorder:
+    """
+    Buffer the commands executed in Maya with their time and append them to a macro in batches.
+    Each command is written with a comment holding the seconds since the recording started.
+
+    The command callback also fires for the commands run inside MEL procedures and runtime commands,
+    which would run twice on replay, so only top level commands are kept. Commands are nested while a
+    MEL procedure is running, and after a runtime command until Maya is idle again.
+    """
+
+    def __init__(self, recordingPath, batchSize=200, segmentWriter=None):
+        self.recordingPath = recordingPath
+        self.batchSize = batchSize
+        self.segmentWriter = segmentWriter
+        self.callbackIds = []
+        self.records = []  # (time, command) waiting to be written
+        self.procedureDepth = 0
+        self.inRunTimeCommand = False
+        self.startTime = 0.0
+
+    def start(self):
+        """
+        Start listening to executed commands.
+        """
+        self.startTime = time.time()
+        self.callbackIds = [
+            OpenMaya.MCommandMessage.addCommandCallback(self._commandCallback),
+            OpenMaya.MCommandMessage.addProcCallback(self._procedureCallback)]
+
+    def stop(self):
+        """
+        Stop listening and write the remaining commands.
+        """
+        for callbackId in self.callbackIds:
+            OpenMaya.MMessage.removeCallback(callbackId)
+        self.callbackIds = []
+        self.flush()
+
+    def flush(self):
+        """
+        Append the buffered commands to the recording file.
+        """
+        if not self.records:
+            return
+        lines = []
+        for recordTime, command in self.records:
+            command = command.strip()
+            if not command.endswith(';') and not command.endswith('}'):
+                command += ';'
+            lines.append('%s  // %s%.3f\n' % (command, recordTimePrefix, recordTime))
+        self.records = []
+
+        macroText = ''.join(lines)
+        if self.segmentWriter:
+            self.segmentWriter.write(macroText)
+            return
+        recordFileSystemCall(bytesWritten=len(macroText))
+        appendMacroFile(self.recordingPath, macroText)
+
+    def _commandCallback(self, command, *args):
+        if self.procedureDepth > 0 or self.inRunTimeCommand:
+            return
+
+        # The commands a runtime command runs arrive before Maya is idle again
+        commandName = re.split(r'[\s(;]', command.strip(), 1)[0]
+        if commandName and cmds.runTimeCommand(commandName, exists=True):
+            self.inRunTimeCommand = True
+            maya.utils.executeDeferred(self._endRunTimeCommand)
+
+        if not isReplayableCommand(command):
+            return
+        self.records.append((time.time() - self.startTime, command))
+        if len(self.records) >= self.batchSize:
+            self.flush()
+
+    def _procedureCallback(self, procedureName, procedureId, isProcedureEntry, *args):
+        if isProcedureEntry:
+            self.procedureDepth += 1
+        else:
+            self.procedureDepth = max(0, self.procedureDepth - 1)
+
+    def _endRunTimeCommand(self):
+        self.inRunTimeCommand = False
+
+
+# Playback Cache
+# Sourcing a macro makes Maya read and parse the file on every play. Instead each macro is wrapped in
+# a global procedure named after its contents and defined once, later plays only call the procedure.
+# The cache is checked against the modified time and size of the file, and the hash of its contents.
+
+_macroProcedureCache = {}
+procedureDefinitionPattern = re.compile(r'^\s*(global\s+)?proc\s', re.MULTILINE)
+
+
+def getMacroProcedureCall(macroPath):
+    """
+    Return the MEL command calling the cached procedure of a macro, defining the procedure if needed.
+    :param macroPath: The path to the macro
+    :return: The procedure call, or None if the macro can not be wrapped in a procedure
+    """
+    fileStat = os.stat(macroPath)
+    recordFileSystemCall()
+    signature = (fileStat.st_mtime, fileStat.st_size)
+
+    cached = _macroProcedureCache.get(macroPath)
+    if cached and cached['signature'] == signature:
+        return cached['call']
+
+    # The file was modified or never played, a save without changes keeps the procedure
+    macroText = readMacroFile(macroPath)
+    macroHash = hashlib.md5(macroText.encode('utf-8')).hexdigest()
+    if cached and cached['hash'] == macroHash:
+        cached['signature'] = signature
+        return cached['call']
+
+    # Procedures can not be defined inside another procedure
+    call = None
+    if not procedureDefinitionPattern.search(macroText):
+        procedureName = 'MacroTools_' + macroHash[:16]
+        mel.eval('global proc ' + procedureName + '()\n{\n' + macroText + '\n}\n')
+        call = procedureName + '();'
+
+    _macroProcedureCache[macroPath] = {'signature': signature, 'hash': macroHash, 'call': call}
+    return call
+
+
+def invalidateMacroProcedure(macroPath):
+    """
+    Forget the cached procedure of a macro so the next play checks its contents again.
+    Called whenever MacroTools changes a macro, as a quick edit can keep the modified time and size
+    on a file system with a coarse modified time.
+    """
+    _macroProcedureCache.pop(macroPath, None)
+
+
+def playMacro(macroPath):
+    """
+    Play a macro, using the cached procedure when possible.
+    Segmented macros are played one segment at a time.
+    """
+    # Segments are sourced in order at the top level, not cached as procedures, so a variable declared
+    # in one segment can be used by the next one and no segment stays defined in Maya after the play
+    if isSegmentedMacro(macroPath):
+        for segmentPath in getMacroSegments(macroPath):
+            mel.eval('source \"' + segmentPath + '\";')
+        return
+
+    # Unchanged macros are sourced once as a procedure and called on later plays
+    procedureCall = getMacroProcedureCall(macroPath)
+    if procedureCall:
+        mel.eval(procedureCall)
+    # Maya can only source plain text, compressed macros are evaluated from memory
+    elif macroPath.endswith(macroExtensions['none']):
+        mel.eval('source \"' + macroPath + '\";')
+    else:
+        mel.eval(readMacroFile(macroPath))
+
+
+def measureMacroPlayback(macroPath, repeats=10):
+    """
+    Compare the average time to play a macro by sourcing it and by calling its cached procedure.
+    The plays are undone afterwards so the scene is left unchanged.
+    :param macroPath: The path to a plain text macro
+    :param repeats: The number of plays for each method. default is 10.
+    :return: A dictionary with the average seconds for 'source' and 'cached'
+    """
+    timings = {}
+    cmds.undoInfo(openChunk=True, chunkName='MacroTools_measurePlayback')
+    try:
+        startTime = time.time()
+        for i in range(repeats):
+            mel.eval('source \"' + macroPath + '\";')
+        timings['source'] = (time.time() - startTime) / repeats
+
+        procedureCall = getMacroProcedureCall(macroPath)
+        if procedureCall:
+            startTime = time.time()
+            for i in range(repeats):
+                mel.eval(getMacroProcedureCall(macroPath))
+            timings['cached'] = (time.time() - startTime) / repeats
+    finally:
+        cmds.undoInfo(closeChunk=True)
+        cmds.undo()
+
+    return timings
+
+
+# Background I/O
+# Macro files are read and written on worker threads so a slow network share never blocks Maya.
+# Work for the same file always goes to the same thread so writes to a file stay in order.
+# Results are passed back to the main thread with executeDeferred.
+
+_macroIOWorker = None
+
+
+def getMacroIOWorker():
+    """
+    Return the shared background I/O worker, starting it the first time.
+    """
+    global _macroIOWorker
+    if _macroIOWorker is None:
+        _macroIOWorker = MacroIOWorker()
+    return _macroIOWorker
+
+
+class MacroIOWorker:
+    """
+    A small pool of threads running file operations, ordered per key.
+    """
+
+    def __init__(self, threadCount=2):
+        self.queues = []
+        for i in range(threadCount):
+            taskQueue = queue.Queue()
+            thread = threading.Thread(target=self._work, args=(taskQueue,), name='MacroToolsIO%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.queues.append(taskQueue)
+
+    def submit(self, key, function, args=(), callback=None, operation='io', macroFolderPath=''):
+        """
+        Queue a file operation.
+        :param key: The file or folder the operation works on, operations with the same key run in order
+        :param function: The function to run on the worker thread
+        :param args: The arguments for the function
+        :param callback: Called on the main thread with the result and the error, if any
+        :param operation: The name the operation is recorded under in the metrics
+        :param macroFolderPath: The macro folder the operation is recorded under in the metrics
+        """
+        self._getQueue(key).put((function, args, callback, operation, macroFolderPath))
+
+    def wait(self, key=None):
+        """
+        Block until the operations queued so far have finished.
+        :param key: Only wait for the operations with this key. default is all operations.
+        """
+        taskQueues = [self._getQueue(key)] if key is not None else self.queues
+        events = []
+        for taskQueue in taskQueues:
+            event = threading.Event()
+            taskQueue.put((event.set, (), None, None, None))
+            events.append(event)
+        for event in events:
+            event.wait()
+
+    def _getQueue(self, key):
+        return self.queues[hash(key) % len(self.queues)]
+
+    def _work(self, taskQueue):
+        while True:
+            function, args, callback, operation, macroFolderPath = taskQueue.get()
+            metric = startOperationMetric(operation, macroFolderPath) if operation else None
+
+            result = None
+            error = None
+            try:
+                result = function(*args)
+            except Exception as exception:
+                error = exception
+            finally:
+                if metric:
+                    finishOperationMetric(metric)
+
+            if callback:
+                maya.utils.executeDeferred(callback, result, error)
+
+
+# Iterate Playback
+# Run a macro many times with different {{placeholder}} values from a table.
+# The macro is compiled once into a procedure taking the placeholders as arguments,
+# so each iteration only costs a procedure call instead of parsing the whole macro again.
+#
+# A placeholder standing on its own is passed as a typed value, for example "move {{x}} 0 0;".
+# Arithmetic operators separate placeholders from the values around them, so "{{x}}-1" and "-{{x}}"
+# are arithmetic as they would be after substituting the values into the text.
+# A placeholder inside a string or a name is joined into it, for example "select pCube{{n}};".
+# A placeholder inside a variable name, "$obj{{n}}", can not be compiled and the macro text is
+# substituted for each iteration instead.
+# The placeholder {{iteration}} is the iteration number when the table does not define it.
+
+placeholderPattern = re.compile(r'\{\{(\w+)\}\}')
+bareTokenPattern = re.compile(r'(?:\{\{\w+\}\}|[^\s;"(){}\[\],+\-*/%=<>!&?])+')
+negatedPlaceholderPattern = re.compile(r'-\{\{(\w+)\}\}(?![^\s;"(){}\[\],+\-*/%=<>!&?])')
+contextMaskPattern = re.compile(r'//[^\n]*|/\*.*?(?:\*/|$)|"(?:\\.|[^"\\])*"?|\{\{\w+\}\}', re.DOTALL)
+melKeywords = set(['if', 'else', 'while', 'for', 'do', 'switch', 'case', 'return', 'global', 'proc',
+                   'int', 'float', 'string', 'vector', 'matrix'])
+
+
+def readIterationTable(tablePath):
+    """
+    Read the rows of a CSV table, the header row names the placeholders.
+    :return: A list of dictionaries, one per iteration
+    """
+    with open(tablePath) as openTableFile:
+        return [dict(row) for row in csv.DictReader(openTableFile)]
+
+
+def _getParameterType(values):
+    """
+    Return the MEL type that can hold all values of a placeholder.
+    """
+    for parameterType, convert in (('int', int), ('float', float)):
+        try:
+            for value in values:
+                convert(value)
+            return parameterType
+        except (TypeError, ValueError):
+            pass
+    return 'string'
+
+
+def _joinPlaceholders(text, quoted):
+    """
+    Turn text containing placeholders into a MEL string expression joining the literal parts and variables.
+    """
+    if not quoted:
+        match = placeholderPattern.match(text)
+        if match and match.end() == len(text):
+            return '$' + match.group(1)
+
+    parts = []
+    position = 0
+    for match in placeholderPattern.finditer(text):
+        literal = text[position:match.start()]
+        if not quoted:
+            literal = literal.replace('\\', '\\\\').replace('"', '\\"')
+        parts.append('"' + literal + '"')
+        parts.append('$' + match.group(1))
+        position = match.end()
+    literal = text[position:]
+    if literal:
+        if not quoted:
+            literal = literal.replace('\\', '\\\\').replace('"', '\\"')
+        parts.append('"' + literal + '"')
+    return '(' + ' + '.join(parts) + ')'
+
+
+def _placeholdersToVariables(macroText):
+    """
+    Replace the placeholders in a macro with MEL variables, skipping comments.
+    Raises a ValueError if a placeholder is part of a variable name.
+    """
+    # Comments, strings and placeholders are masked so the context of a minus sign can be looked up
+    maskedText = contextMaskPattern.sub(
+        lambda match: (' ' if match.group(0).startswith('/') else 'x') * len(match.group(0)), macroText)
+
+    result = []
+    position = 0
+    length = len(macroText)
+    while position < length:
+        if macroText.startswith('//', position):
+            end = macroText.find('\n', position)
+            end = length if end < 0 else end
+            result.append(macroText[position:end])
+        elif macroText.startswith('/*', position):
+            end = macroText.find('*/', position + 2)
+            end = length if end < 0 else end + 2
+            result.append(macroText[position:end])
+        elif macroText[position] == '"':
+            # Find the closing quote, skipping escaped characters
+            end = position + 1
+            while end < length and macroText[end] != '"':
+                end += 2 if macroText[end] == '\\' else 1
+            end = min(end + 1, length)
+            literal = macroText[position:end]
+            if placeholderPattern.search(literal):
+                literal = _joinPlaceholders(literal[1:-1], quoted=True)
+            result.append(literal)
+        elif _isNegatedPlaceholder(macroText, maskedText, position):
+            # A minus sign in front of a placeholder negates its value, "move -r -{{x}} 0 0;"
+            match = negatedPlaceholderPattern.match(macroText, position)
+            end = match.end()
+            result.append('(-$' + match.group(1) + ')')
+        else:
+            match = bareTokenPattern.match(macroText, position)
+            if match:
+                end = match.end()
+                token = match.group(0)
+                if placeholderPattern.search(token):
+                    if token.startswith('$'):
+                        raise ValueError('Placeholders can not be part of a variable name: ' + token)
+                    token = _joinPlaceholders(token, quoted=False)
+                result.append(token)
+            else:
+                end = position + 1
+                result.append(macroText[position])
+        position = end
+    return ''.join(result)
+
+
+def _isNegatedPlaceholder(macroText, maskedText, position):
+    """
+    Return True if a minus sign at the position negates the placeholder after it rather than subtracting it.
+    :param maskedText: The macro with its comments, strings and placeholders masked out
+    """
+    if not negatedPlaceholderPattern.match(macroText, position):
+        return False
+
+    # At the start of an operand, "$a = -{{x}};" or "2*-{{x}}", it negates
+    previous = maskedText[:position].rstrip()
+    if not previous or previous[-1] in ';({[,+-*/%=<>!&?':
+        return True
+
+    # Right after an operand, "{{x}}-{{y}}", it subtracts
+    if position == len(previous):
+        return False
+
+    # After a space it is a negative argument of a command, "move -r 1 -{{x}} 0;",
+    # but inside an expression, "$a = 1 -{{x}};", it subtracts
+    statementStart = max(maskedText.rfind(character, 0, position) for character in ';{}') + 1
+    statement = maskedText[statementStart:position]
+    if '=' in statement or statement.count('(') > statement.count(')'):
+        return False
+    command = statement.split(None, 1)[0]
+    return bool(re.match(r'[A-Za-z_]\w*$', command)) and command not in melKeywords
+
+
+def _formatMelValue(value, parameterType):
+    if parameterType == 'string':
+        return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return str(value)
+
+
+def runMacroIterations(macroText, rows, macroName='macro'):
+    """
+    Run a macro once for each row of placeholder values inside a single undo chunk.
+    :param macroText: The macro contents with {{placeholders}}
+    :param rows: A list of dictionaries of placeholder values, one per iteration
+    :param macroName: The name used for the undo chunk. default is 'macro'.
+    :return: A dictionary with the compile time, a list of times per iteration and the total time
+    """
+    startTime = time.time()
+
+    # Collect the placeholders in the order they first appear
+    names = []
+    for name in placeholderPattern.findall(macroText):
+        if name not in names:
+            names.append(name)
+    rows = [dict(row) for row in rows]
+    for iteration, row in enumerate(rows):
+        row.setdefault('iteration', iteration)
+        missing = [name for name in names if name not in row]
+        if missing:
+            raise ValueError('Iteration %d is missing values for: %s' % (iteration, ', '.join(missing)))
+    parameterTypes = dict((name, _getParameterType([row[name] for row in rows])) for name in names)
+
+    # Procedures can not be defined inside another procedure, and placeholders in variable names can not
+    # be compiled, substitute the text for each iteration instead
+    procedureName = None
+    body = None
+    if not procedureDefinitionPattern.search(macroText):
+        try:
+            body = _placeholdersToVariables(macroText)
+        except ValueError:
+            pass
+    if body is not None:
+        arguments = ', '.join(parameterTypes[name] + ' $' + name for name in names)
+        procedureName = 'MacroTools_iterate_' + hashlib.md5((arguments + body).encode('utf-8')).hexdigest()[:16]
+        mel.eval('global proc ' + procedureName + '(' + arguments + ')\n{\n' + body + '\n}\n')
+    compileTime = time.time() - startTime
+
+    iterationTimes = []
+    cmds.undoInfo(openChunk=True, chunkName='MacroTools_iterate_' + macroName)
+    try:
+        for row in rows:
+            iterationStart = time.time()
+            if procedureName:
+                values = ', '.join(_formatMelValue(row[name], parameterTypes[name]) for name in names)
+                mel.eval(procedureName + '(' + values + ');')
+            else:
+                mel.eval(substituteMacroParameters(macroText, row))
+            iterationTimes.append(time.time() - iterationStart)
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+    return {'compile': compileTime, 'iterations': iterationTimes, 'total': time.time() - startTime}
+
+
+# Persistent Window
+# show() keeps one MacroTools window alive between shelf clicks. Reopening it shows the existing
+# window with its active macro and undo history, and only refreshes what changed on disk.
+
+_macroToolsInstance = None
+
+
+def show():
+    """
+    Show the MacroTools window, building it only the first time.
+    :return: The MacroTools instance
+    """
+    global _macroToolsInstance
+    metric = startOperationMetric('showWindow', cmds.optionVar(q='MacroToolsDirectory'))
+    try:
+        if _macroToolsInstance is not None and _macroToolsInstance._isWindowBuilt():
+            _macroToolsInstance._reopen()
+        else:
+            _macroToolsInstance = MacroTools()
+    finally:
+        finishOperationMetric(metric)
+
+    print('MacroTools shown in %.4fs' % metric['wallTime'])
+    return _macroToolsInstance
+
+
+# Segmented Recording
+# Long recordings are split into fixed size segment files inside a <macro>.segments folder.
+# A manifest lists the segments in order with their size and hash. It is rewritten whenever a
+# segment is started or finished, so a crash loses at most the segment being written.
+# Segments always end on a whole line so each one can be played on its own.
+
+segmentedMacroExtension = '.segments'
+segmentManifestName = 'manifest.json'
+defaultSegmentSize = 1024 * 1024
+
+
+def getRecordingSegmentSize():
+    """
+    Return the size in bytes at which recordings start a new segment, 0 if recordings are not segmented.
+    """
+    if cmds.optionVar(exists='MacroToolsSegmentSize'):
+        return max(0, cmds.optionVar(q='MacroToolsSegmentSize'))
+    return 0
+
+
+def isSegmentedMacro(macroPath):
+    """
+    Return True if the macro is a folder of segments.
+    """
+    return macroPath.endswith(segmentedMacroExtension)
+
+
+def readSegmentManifest(macroPath):
+    """
+    Return the manifest of a segmented macro.
+    """
+    recordFileSystemCall()
+    with open(macroPath + '/' + segmentManifestName) as openManifestFile:
+        return json.load(openManifestFile)
+
+
+def writeSegmentManifest(macroPath, manifest):
+    """
+    Replace the manifest of a segmented macro. A temporary file is written first and moved over the
+    manifest in one step, so the manifest on disk is always either the old or the new one.
+    """
+    manifestPath = macroPath + '/' + segmentManifestName
+    recordFileSystemCall(2)
+    with open(manifestPath + '.tmp', 'w') as openManifestFile:
+        json.dump(manifest, openManifestFile, indent=4)
+    MacroToolsSync.replaceFile(manifestPath + '.tmp', manifestPath)
+
+
+def getMacroSegments(macroPath):
+    """
+    Return the paths of the finished segments of a segmented macro, in order.
+    """
+    return [macroPath + '/' + segment['file']
+            for segment in readSegmentManifest(macroPath)['segments'] if segment['complete']]
+
+
+def _hashSegment(segmentPath):
+    """
+    Return the md5 hash, size and line count of a segment file.
+    """
+    segmentHash = hashlib.md5()
+    size = 0
+    lines = 0
+    recordFileSystemCall()
+    with open(segmentPath, 'rb') as openSegmentFile:
+        for line in openSegmentFile:
+            segmentHash.update(line)
+            size += len(line)
+            lines += 1
+    recordFileSystemCall(bytesRead=size)
+    return segmentHash.hexdigest(), size, lines
+
+
+def validateSegmentedMacro(macroPath):
+    """
+    Check every segment of a segmented macro against the manifest.
+    :return: A list describing each problem, empty if the macro is valid
+    """
+    problems = []
+    manifest = readSegmentManifest(macroPath)
+    for segment in manifest['segments']:
+        segmentPath = macroPath + '/' + segment['file']
+        if not os.path.isfile(segmentPath):
+            problems.append(segment['file'] + ' is missing')
+        elif not segment['complete']:
+            problems.append(segment['file'] + ' was not finished, the recording may have been interrupted')
+        elif _hashSegment(segmentPath)[0] != segment['md5']:
+            problems.append(segment['file'] + ' does not match its hash')
+    return problems
+
+
+def readSegmentedMacroPreview(macroPath):
+    """
+    Return a short summary and the last segment of a segmented macro, and the modified time of its manifest.
+    """
+    segments = readSegmentManifest(macroPath)['segments']
+    complete = [segment for segment in segments if segment['complete']]
+    preview = '// %d segments, %d bytes, %d lines\n' % (
+        len(complete), sum(segment['bytes'] for segment in complete), sum(segment['lines'] for segment in complete))
+    if complete:
+        preview += '// Showing ' + complete[-1]['file'] + '\n'
+        preview += readMacroFile(macroPath + '/' + complete[-1]['file'])
+
+    recordFileSystemCall()
+    return preview, os.path.getmtime(macroPath)
+
+
+def convertToSegmentedMacro(macroPath, segmentSize=defaultSegmentSize):
+    """
+    Move the contents of a macro file into a new segmented macro folder, line by line.
+    :return: The path of the segmented macro
+    """
+    segmentedPath = splitMacroExtension(macroPath)[0] + segmentedMacroExtension
+    segmentWriter = MacroSegmentWriter(segmentedPath, segmentSize)
+
+    openMacroFile = openMacroStream(macroPath)
+    try:
+        lines = []
+        size = 0
+        for line in openMacroFile:
+            lines.append(line)
+            size += len(line)
+            if size >= min(macroStreamChunkSize, segmentSize):
+                segmentWriter.write(''.join(lines))
+                lines = []
+                size = 0
+        segmentWriter.write(''.join(lines))
+    finally:
+        openMacroFile.close()
+    segmentWriter.close()
+
+    os.remove(macroPath)
+    return segmentedPath
+
+
+class MacroSegmentWriter:
+    """
+    Append a recording to a segmented macro, starting a new segment when the current one is full.
+    """
+
+    def __init__(self, macroPath, segmentSize=defaultSegmentSize):
+        self.macroPath = macroPath
+        self.segmentSize = segmentSize
+        self.segmentPath = ''
+
+        if not os.path.isdir(macroPath):
+            os.makedirs(macroPath)
+            self.manifest = {'segmentSize': segmentSize, 'segments': []}
+        else:
+            self.manifest = readSegmentManifest(macroPath)
+        self._startSegment()
+
+    def write(self, macroText):
+        """
+        Append text to the current segment, starting a new segment once the text ends a full segment.
+        """
+        if not macroText:
+            return
+        recordFileSystemCall(bytesWritten=len(macroText))
+        appendMacroFile(self.segmentPath, macroText)
+        if macroText.endswith('\n') and self.isFull():
+            self.rotate()
+
+    def isFull(self):
+        """
+        Return True if the current segment has reached the segment size.
+        """
+        recordFileSystemCall()
+        return os.path.getsize(self.segmentPath) >= self.segmentSize
+
+    def rotate(self):
+        """
+        Finish the current segment and start the next one.
+        :return: The path of the new segment
+        """
+        self._finishSegment()
+        self._startSegment()
+        return self.segmentPath
+
+    def close(self):
+        """
+        Finish the current segment, an empty segment is removed instead.
+        """
+        segment = self.manifest['segments'][-1]
+        recordFileSystemCall()
+        if os.path.getsize(self.segmentPath) == 0:
+            os.remove(self.segmentPath)
+            self.manifest['segments'].remove(segment)
+            writeSegmentManifest(self.macroPath, self.manifest)
+        else:
+            self._finishSegment()
+
+    def _startSegment(self):
+        # Continue numbering after the existing segments
+        fileName = 'segment_%05d.txt' % len(self.manifest['segments'])
+        self.segmentPath = self.macroPath + '/' + fileName
+        open(self.segmentPath, 'a').close()
+        self.manifest['segments'].append({'file': fileName, 'bytes': 0, 'lines': 0, 'md5': '', 'complete': False})
+        writeSegmentManifest(self.macroPath, self.manifest)
+
+    def _finishSegment(self):
+        segment = self.manifest['segments'][-1]
+        segment['md5'], segment['bytes'], segment['lines'] = _hashSegment(self.segmentPath)
+        segment['complete'] = True
+        writeSegmentManifest(self.macroPath, self.manifest)
+
+
+class SegmentedMacroStream:
+    """
+    A read only text stream over the segments of a segmented macro, opening one segment at a time.
+    """
+
+    def __init__(self, segmentPaths, errors='replace'):
+        self.segmentPaths = list(segmentPaths)
+        self.errors = errors
+        self.openSegmentFile = None
+
+    def read(self, size=-1):
+        chunks = []
+        while size < 0 or size > 0:
+            if self.openSegmentFile is None:
+                if not self.segmentPaths:
+                    break
+                self.openSegmentFile = openMacroStream(self.segmentPaths.pop(0), self.errors)
+            chunk = self.openSegmentFile.read(size)
+            if not chunk:
+                self.openSegmentFile.close()
+                self.openSegmentFile = None
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return ''.join(chunks)
+
+    def __iter__(self):
+        for segmentPath in self.segmentPaths:
+            openSegmentFile = openMacroStream(segmentPath, self.errors)
+            try:
+                for line in openSegmentFile:
+                    yield line
+            finally:
+                openSegmentFile.close()
+
+    def close(self):
+        if self.openSegmentFile is not None:
+            self.openSegmentFile.close()
+            self.openSegmentFile = None
@@ -0,0 +1,313 @@
+# MacroToolsClient.py
+# v1.0
+#
+# Run MacroTools macros from outside of Maya through a command port.
+# Does not require Maya, only the python standard library.
+#
+# In Maya open the command port with:
+#   import MacroTools
+#   MacroTools.openMacroCommandPort(7002)
+#
+# Then from any python session:
+#   import MacroToolsClient
+#   client = MacroToolsClient.MacroToolsClient(port=7002)
+#   client.runMacro('myMacro', {'offset': 5})
+#
+# Brooke Waddington
+# https://github.com/BrookeWaddington/MacroTools
+
+import ast
+import json
+import re
+import socket
+import threading
+import time
+
+try:
+    import Queue as queue  # Python 2
+except ImportError:
+    import queue
+
+commandPortBufferSize = 65536  # Matches MacroTools.openMacroCommandPort
+resultSize = 512  # Room kept in the buffer for each result, errors are cut to fit
+
+
+class MacroToolsClient:
+
+    def __init__(self, host='localhost', port=7002, poolSize=2, timeout=30.0, bufferSize=commandPortBufferSize):
+        self.host = host
+        self.port = port
+        self.bufferSize = bufferSize
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self.requestCount = 0
+        self.requestCountLock = threading.Lock()
+
+        # Persistent connections are created on demand and reused between requests
+        self.connections = queue.Queue()
+        self.connectionCount = 0
+        self.connectionCountLock = threading.Lock()
+
+    def runMacro(self, macro, parameters=None):
+        """
+        Run a single macro in Maya and wait for the result.
+        :param macro: The name of the macro without the .txt extension
+        :param parameters: A dictionary of placeholder names and values. default is None.
+        :return: The result dictionary returned by Maya
+        """
+        return self.runMacros([(macro, parameters)])[0]
+
+    def runMacros(self, requests):
+        """
+        Batch many macro requests into as few command port calls as possible.
+        Maya answers each buffer it receives once, so every call is one JSON list that fits in the
+        command port buffer and is answered with one JSON list.
+        :param requests: A list of macro names or (macro, parameters) tuples
+        :return: A list of result dictionaries in the same order as the requests
+        """
+        results = []
+        for batch in self._splitRequests(requests):
+            results.extend(self._call(batch))
+        return results
+
+    def benchmark(self, macro, count=1000, batchSize=100, parameters=None):
+        """
+        Measure how many requests per second the command port can serve.
+        :param macro: The name of the macro to run
+        :param count: The total number of requests to send. default is 1000.
+        :param batchSize: The number of requests passed to runMacros together. default is 100.
+        :param parameters: A dictionary of placeholder names and values. default is None.
+        :return: A dictionary with the request count, failures, seconds and requests per second
+        """
+        failures = 0
+        startTime = time.time()
+        sent = 0
+        while sent < count:
+            batch = min(batchSize, count - sent)
+            for result in self.runMacros([(macro, parameters)] * batch):
+                if not result.get('success'):
+                    failures += 1
+            sent += batch
+        seconds = time.time() - startTime
+
+        return {
+            'requests': count,
+            'failures': failures,
+            'seconds': seconds,
+            'requestsPerSecond': count / seconds if seconds else 0.0}
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        while True:
+            try:
+                connection = self.connections.get_nowait()
+            except queue.Empty:
+                break
+            self._discardConnection(connection)
+
+    def _buildRequest(self, request):
+        """
+        Build the request dictionary for a macro name or (macro, parameters) tuple.
+        """
+        if isinstance(request, tuple):
+            macro, parameters = request
+        else:
+            macro, parameters = request, None
+
+        with self.requestCountLock:
+            self.requestCount += 1
+            requestId = self.requestCount
+        return {'id': requestId, 'macro': macro, 'parameters': parameters or {}}
+
+    def _buildCommand(self, requests):
+        """
+        Build the python command sent to the command port for a batch of requests.
+        """
+        return "__import__('MacroTools').remoteRunMacros(%r)\n" % str(json.dumps(requests))
+
+    def _splitRequests(self, requests):
+        """
+        Split requests into batches whose command and results both fit in the command port buffer.
+        """
+        maxRequests = max(1, self.bufferSize // resultSize)
+        batch = []
+        for request in requests:
+            request = self._buildRequest(request)
+            if batch and (len(batch) >= maxRequests or
+                          len(self._buildCommand(batch + [request]).encode('utf-8')) > self.bufferSize):
+                yield batch
+                batch = []
+            batch.append(request)
+            if len(batch) == 1 and len(self._buildCommand(batch).encode('utf-8')) > self.bufferSize:
+                raise ValueError('Request for %s does not fit in the %d byte command port buffer'
+                                 % (request['macro'], self.bufferSize))
+        if batch:
+            yield batch
+
+    def _call(self, requests):
+        """
+        Send one batch of requests and wait for its single response.
+        """
+        connection = self._acquireConnection()
+        try:
+            startTime = time.time()
+            connection.sendall(self._buildCommand(requests).encode('utf-8'))
+            response = self._readResponse(connection)
+            roundTripTime = time.time() - startTime
+            results = json.loads(response)
+            if not isinstance(results, list) or len(results) != len(requests):
+                raise ValueError('Unexpected response from Maya: %s' % response[:200])
+        except (socket.error, ValueError):
+            # Drop the connection, a partial response would be read by the next call
+            self._discardConnection(connection)
+            raise
+        self._releaseConnection(connection)
+
+        for result in results:
+            result.setdefault('timings', {})['roundTrip'] = roundTripTime / len(results)
+        return results
+
+    def _readResponse(self, connection):
+        """
+        Read one response from a connection, Maya ends each response with a null character.
+        """
+        buffer = b''
+        while b'\x00' not in buffer:
+            data = connection.recv(self.bufferSize)
+            if not data:
+                raise socket.error('Connection closed by Maya')
+            buffer += data
+        response, remainder = buffer.split(b'\x00', 1)
+        if remainder.strip():
+            raise ValueError('Maya sent more than one response for a single call')
+        return response.strip().decode('utf-8')
+
+    def _acquireConnection(self):
+        """
+        Take a connection from the pool, opening a new one if the pool is not full.
+        """
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.connectionCountLock:
+            canOpen = self.connectionCount < self.poolSize
+            if canOpen:
+                self.connectionCount += 1
+
+        if not canOpen:
+            return self.connections.get(timeout=self.timeout)
+
+        try:
+            connection = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except socket.error:
+            with self.connectionCountLock:
+                self.connectionCount -= 1
+            raise
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def _releaseConnection(self, connection):
+        """
+        Return a connection to the pool.
+        """
+        self.connections.put(connection)
+
+    def _discardConnection(self, connection):
+        """
+        Close a connection and free its place in the pool.
+        """
+        try:
+            connection.close()
+        except socket.error:
+            pass
+        with self.connectionCountLock:
+            self.connectionCount -= 1
+
+
+class LocalMacroServer:
+    """
+    A local socket stand-in for a Maya command port.
+    Like Maya it reads at most bufferSize bytes at a time and answers every buffer it receives with
+    one null terminated response, so a command split across buffers fails as it would in Maya.
+    Requests are answered with a handler so the client can be tested without Maya.
+    """
+
+    def __init__(self, host='localhost', port=0, handler=None, bufferSize=commandPortBufferSize):
+        self.host = host
+        self.handler = handler or self._defaultHandler
+        self.bufferSize = bufferSize
+        self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.serverSocket.bind((host, port))
+        self.serverSocket.listen(5)
+        self.port = self.serverSocket.getsockname()[1]
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start serving connections on a background thread.
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the server and close the listening socket.
+        """
+        self.running = False
+        try:
+            self.serverSocket.close()
+        except socket.error:
+            pass
+
+    def _serve(self):
+        while self.running:
+            try:
+                connection, address = self.serverSocket.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self._handleConnection, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _handleConnection(self, connection):
+        try:
+            while True:
+                try:
+                    data = connection.recv(self.bufferSize)
+                except socket.error:
+                    return
+                if not data:
+                    return
+                response = self._runCommand(data.decode('utf-8', 'replace'))
+                connection.sendall(response.encode('utf-8')[:self.bufferSize - 2] + b'\n\x00')
+        finally:
+            connection.close()
+
+    def _runCommand(self, command):
+        """
+        Pull the requests out of a remoteRunMacros command and answer them like Maya would.
+        """
+        match = re.match(r"__import__\('MacroTools'\)\.remoteRunMacros\((.*)\)$", command.strip())
+        try:
+            requests = json.loads(ast.literal_eval(match.group(1)))
+        except (AttributeError, SyntaxError, ValueError):
+            return '# Error: invalid command: %s' % command[:80]
+        return json.dumps([json.loads(self.handler(request)) for request in requests])
+
+    @staticmethod
+    def _defaultHandler(request):
+        return json.dumps({
+            'id': request.get('id'),
+            'macro': request.get('macro'),
+            'success': True,
+            'error': None,
+            'timings': {'read': 0.0, 'execute': 0.0, 'total': 0.0}})
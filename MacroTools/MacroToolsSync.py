@@ -0,0 +1,385 @@
+# MacroToolsSync.py
+# v1.0
+#
+# Keep two macro folders in step, for example a local folder and a shared folder.
+# Does not require Maya, only the python standard library.
+#
+# Each folder keeps a manifest with the hash and block signatures of every file. Files that have
+# not changed since the last sync are never read again, renamed files are moved instead of copied,
+# and changed files are rebuilt from the blocks the destination already has.
+#
+# From Maya use Options > Sync Macro Folder..., or from any python session:
+#   import MacroToolsSync
+#   MacroToolsSync.syncMacroFolders('/local/macros', '/shared/macros')
+#
+# Or from a shell:
+#   python MacroToolsSync.py /local/macros /shared/macros [--dry-run]
+#
+# Brooke Waddington
+# https://github.com/BrookeWaddington/MacroTools
+
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+
+manifestName = '.macroToolsSync.json'
+temporaryExtension = '.sync.tmp'
+# Files MacroTools is still writing, temporary files of atomic writes and compressed macro recordings
+skippedExtensions = ('.tmp', '.recording')
+segmentManifestName = 'manifest.json'
+segmentedMacroExtension = '.segments'
+
+# Blocks end on a line whose checksum hits the divisor, so an edit only changes the blocks around it
+# and the following blocks line up again. Files without lines, like compressed macros, use maxBlockSize.
+minBlockSize = 2 * 1024
+maxBlockSize = 16 * 1024
+blockDivisor = 16
+
+
+def getBlockSignatures(filePath):
+    """
+    Split a file into content defined blocks.
+    :return: The md5 of the whole file and a list of [block hash, block size]
+    """
+    fileHash = hashlib.md5()
+    blocks = []
+    block = []
+    blockSize = 0
+
+    with open(filePath, 'rb') as openFile:
+        for line in _iterateLines(openFile):
+            fileHash.update(line)
+            block.append(line)
+            blockSize += len(line)
+            if blockSize >= maxBlockSize or (blockSize >= minBlockSize and zlib.crc32(line) % blockDivisor == 0):
+                blocks.append(_finishBlock(block, blockSize))
+                block = []
+                blockSize = 0
+    if block:
+        blocks.append(_finishBlock(block, blockSize))
+
+    return fileHash.hexdigest(), blocks
+
+
+def _iterateLines(openFile):
+    """
+    Yield the lines of a binary file, splitting very long lines so no piece is bigger than a block.
+    """
+    for line in openFile:
+        while len(line) > maxBlockSize:
+            yield line[:maxBlockSize]
+            line = line[maxBlockSize:]
+        yield line
+
+
+def _finishBlock(block, blockSize):
+    return [hashlib.md5(b''.join(block)).hexdigest()[:16], blockSize]
+
+
+def loadManifest(folderPath):
+    """
+    Return the manifest of a folder, or an empty manifest if it has none.
+    """
+    manifestPath = os.path.join(folderPath, manifestName)
+    if os.path.isfile(manifestPath):
+        try:
+            with open(manifestPath) as openManifestFile:
+                manifest = json.load(openManifestFile)
+            manifest.setdefault('files', {})
+            manifest.setdefault('syncs', {})
+            return manifest
+        except ValueError:
+            pass  # A damaged manifest is rebuilt
+    return {'files': {}, 'syncs': {}}
+
+
+def saveManifest(folderPath, manifest):
+    """
+    Replace the manifest of a folder, writing a temporary file first so it is never half written.
+    """
+    manifestPath = os.path.join(folderPath, manifestName)
+    with open(manifestPath + temporaryExtension, 'w') as openManifestFile:
+        json.dump(manifest, openManifestFile)
+    replaceFile(manifestPath + temporaryExtension, manifestPath)
+
+
+def updateManifest(folderPath, save=True):
+    """
+    Bring the manifest of a folder up to date, only hashing files whose size or modified time changed.
+    :param save: Save the updated manifest in the folder. default is True.
+    :return: The manifest and the number of files that were hashed
+    """
+    manifest = loadManifest(folderPath)
+    files = {}
+    hashedCount = 0
+
+    for fileName in _listFiles(folderPath):
+        fileStat = os.stat(os.path.join(folderPath, fileName))
+        entry = manifest['files'].get(fileName)
+        if not entry or entry['size'] != fileStat.st_size or entry['mtime'] != fileStat.st_mtime:
+            fileHash, blocks = getBlockSignatures(os.path.join(folderPath, fileName))
+            entry = {'size': fileStat.st_size, 'mtime': fileStat.st_mtime, 'md5': fileHash, 'blocks': blocks}
+            hashedCount += 1
+        files[fileName] = entry
+
+    manifest['files'] = files
+    if save:
+        saveManifest(folderPath, manifest)
+    return manifest, hashedCount
+
+
+def _listFiles(folderPath):
+    """
+    Return the paths of all files below a folder, relative to it and using forward slashes.
+    Files that are still being written are skipped, including the unfinished segment of a segmented
+    recording, so a recording in progress on another workstation is not copied half written.
+    """
+    fileNames = []
+    for root, directories, names in os.walk(folderPath):
+        directories.sort()
+        unfinished = _getUnfinishedSegments(root) if root.endswith(segmentedMacroExtension) else set()
+        for name in sorted(names):
+            if name == manifestName or name.endswith(temporaryExtension) or name.endswith(skippedExtensions):
+                continue
+            if name in unfinished:
+                continue
+            relativePath = os.path.relpath(os.path.join(root, name), folderPath)
+            fileNames.append(relativePath.replace(os.sep, '/'))
+    return fileNames
+
+
+def _getUnfinishedSegments(segmentedMacroPath):
+    """
+    Return the file names of the segments of a segmented macro that are not finished yet.
+    """
+    try:
+        with open(os.path.join(segmentedMacroPath, segmentManifestName)) as openManifestFile:
+            segments = json.load(openManifestFile)['segments']
+    except (IOError, OSError, ValueError, KeyError):
+        return set()
+    return set(segment['file'] for segment in segments if not segment.get('complete'))
+
+
+def _getFolderKey(folderPath):
+    return os.path.normcase(os.path.abspath(folderPath))
+
+
+def replaceFile(sourcePath, targetPath):
+    """
+    Move a file over another one in a single step, so the target is always either the old or the new file.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(sourcePath, targetPath)
+    elif os.name == 'nt':
+        # Python 2 on Windows can not rename over an existing file, MoveFileEx can
+        import ctypes
+        moveFileReplaceExisting, moveFileWriteThrough = 0x1, 0x8
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(sourcePath), unicode(targetPath),
+                                                  moveFileReplaceExisting | moveFileWriteThrough):
+            raise ctypes.WinError()
+    else:
+        os.rename(sourcePath, targetPath)
+
+
+def syncMacroFolders(folderA, folderB, dryRun=False):
+    """
+    Synchronize two macro folders in both directions.
+    A file changed on one side since the last sync is copied to the other side, a file deleted on one
+    side is deleted on the other, and a file changed on both sides is reported as a conflict and left alone.
+    :param folderA: The first macro folder
+    :param folderB: The second macro folder
+    :param dryRun: Only report what would change. default is False.
+    :return: A dictionary describing what was copied, renamed, deleted and in conflict, and the bytes moved
+    """
+    startTime = time.time()
+    # A dry run leaves both folders untouched, including their manifests
+    manifestA, hashedA = updateManifest(folderA, save=not dryRun)
+    manifestB, hashedB = updateManifest(folderB, save=not dryRun)
+    filesA = manifestA['files']
+    filesB = manifestB['files']
+
+    # The state of both folders after the last sync tells which side changed a file
+    base = manifestA['syncs'].get(_getFolderKey(folderB), {})
+
+    report = {
+        'copied': [],  # (file, source folder, target folder)
+        'renamed': [],  # (old file, new file, folder)
+        'deleted': [],  # (file, folder)
+        'conflicts': [],  # (file, reason)
+        'bytesTransferred': 0,
+        'bytesReused': 0,
+        'filesHashed': hashedA + hashedB,
+        'seconds': 0.0}
+
+    # Decide what each file needs
+    copies = []  # (file, source folder, source files, target folder, target files)
+    deletes = []  # (file, folder, files)
+    for fileName in sorted(set(filesA) | set(filesB)):
+        hashA = filesA[fileName]['md5'] if fileName in filesA else None
+        hashB = filesB[fileName]['md5'] if fileName in filesB else None
+        baseHash = base.get(fileName)
+        if hashA == hashB:
+            continue
+
+        changedA = hashA != baseHash
+        changedB = hashB != baseHash
+        if changedA and changedB:
+            if hashA and hashB:
+                report['conflicts'].append((fileName, 'changed in both folders'))
+            elif hashA:
+                report['conflicts'].append((fileName, 'changed in ' + folderA + ' and deleted in ' + folderB))
+            else:
+                report['conflicts'].append((fileName, 'changed in ' + folderB + ' and deleted in ' + folderA))
+        elif changedA:
+            if hashA:
+                copies.append((fileName, folderA, filesA, folderB, filesB))
+            else:
+                deletes.append((fileName, folderB, filesB))
+        else:
+            if hashB:
+                copies.append((fileName, folderB, filesB, folderA, filesA))
+            else:
+                deletes.append((fileName, folderA, filesA))
+
+    # A file deleted in the target with the same contents as a new file was renamed
+    remainingCopies = []
+    for fileName, sourceFolder, sourceFiles, targetFolder, targetFiles in copies:
+        fileHash = sourceFiles[fileName]['md5']
+        rename = None
+        if fileName not in targetFiles:
+            for delete in deletes:
+                if delete[1] == targetFolder and targetFiles[delete[0]]['md5'] == fileHash:
+                    rename = delete
+                    break
+        if rename:
+            deletes.remove(rename)
+            report['renamed'].append((rename[0], fileName, targetFolder))
+            if not dryRun:
+                _renameFile(targetFolder, targetFiles, rename[0], fileName)
+        else:
+            remainingCopies.append((fileName, sourceFolder, sourceFiles, targetFolder, targetFiles))
+
+    for fileName, sourceFolder, sourceFiles, targetFolder, targetFiles in remainingCopies:
+        report['copied'].append((fileName, sourceFolder, targetFolder))
+        if not dryRun:
+            transferred, reused = _transferFile(sourceFolder, sourceFiles, targetFolder, targetFiles, fileName)
+            report['bytesTransferred'] += transferred
+            report['bytesReused'] += reused
+
+    for fileName, folder, files in deletes:
+        report['deleted'].append((fileName, folder))
+        if not dryRun:
+            os.remove(os.path.join(folder, fileName))
+            del files[fileName]
+
+    if not dryRun:
+        # Remember the files that now match, conflicts keep their previous state
+        synced = dict((fileName, filesA[fileName]['md5']) for fileName in filesA
+                      if fileName in filesB and filesA[fileName]['md5'] == filesB[fileName]['md5'])
+        for fileName, reason in report['conflicts']:
+            if fileName in base:
+                synced[fileName] = base[fileName]
+        manifestA['syncs'][_getFolderKey(folderB)] = synced
+        manifestB['syncs'][_getFolderKey(folderA)] = synced
+        saveManifest(folderA, manifestA)
+        saveManifest(folderB, manifestB)
+
+    report['seconds'] = time.time() - startTime
+    return report
+
+
+def _renameFile(folderPath, files, oldName, newName):
+    """
+    Rename a file in a folder and its manifest entry.
+    """
+    newPath = os.path.join(folderPath, newName)
+    if not os.path.isdir(os.path.dirname(newPath)):
+        os.makedirs(os.path.dirname(newPath))
+    os.rename(os.path.join(folderPath, oldName), newPath)
+    files[newName] = files.pop(oldName)
+
+
+def _transferFile(sourceFolder, sourceFiles, targetFolder, targetFiles, fileName):
+    """
+    Rebuild a file in the target folder, reading only the blocks the target does not already have.
+    :return: The bytes read from the source and the bytes reused from the target
+    """
+    sourceEntry = sourceFiles[fileName]
+    sourcePath = os.path.join(sourceFolder, fileName)
+    targetPath = os.path.join(targetFolder, fileName)
+    if not os.path.isdir(os.path.dirname(targetPath)):
+        os.makedirs(os.path.dirname(targetPath))
+
+    # Blocks of the old target file that can be reused, wherever they are
+    reusableBlocks = {}
+    if fileName in targetFiles:
+        offset = 0
+        for blockHash, blockSize in targetFiles[fileName]['blocks']:
+            reusableBlocks.setdefault(blockHash, (offset, blockSize))
+            offset += blockSize
+
+    transferred = 0
+    reused = 0
+    fileHash = hashlib.md5()
+    openTargetFile = open(targetPath, 'rb') if reusableBlocks else None
+    try:
+        with open(sourcePath, 'rb') as openSourceFile:
+            with open(targetPath + temporaryExtension, 'wb') as openTemporaryFile:
+                sourceOffset = 0
+                for blockHash, blockSize in sourceEntry['blocks']:
+                    if blockHash in reusableBlocks:
+                        offset, size = reusableBlocks[blockHash]
+                        openTargetFile.seek(offset)
+                        block = openTargetFile.read(size)
+                        reused += size
+                    else:
+                        openSourceFile.seek(sourceOffset)
+                        block = openSourceFile.read(blockSize)
+                        transferred += blockSize
+                    fileHash.update(block)
+                    openTemporaryFile.write(block)
+                    sourceOffset += blockSize
+    finally:
+        if openTargetFile:
+            openTargetFile.close()
+
+    # The source changed while syncing, leave the target as it was
+    if fileHash.hexdigest() != sourceEntry['md5']:
+        os.remove(targetPath + temporaryExtension)
+        raise IOError(fileName + ' changed while it was being synced')
+
+    replaceFile(targetPath + temporaryExtension, targetPath)
+    targetStat = os.stat(targetPath)
+    targetFiles[fileName] = dict(sourceEntry, size=targetStat.st_size, mtime=targetStat.st_mtime)
+    return transferred, reused
+
+
+def formatSyncReport(report):
+    """
+    Return a short readable summary of a sync report.
+    """
+    lines = []
+    for fileName, sourceFolder, targetFolder in report['copied']:
+        lines.append('copied   ' + fileName + ' to ' + targetFolder)
+    for oldName, newName, folder in report['renamed']:
+        lines.append('renamed  ' + oldName + ' to ' + newName + ' in ' + folder)
+    for fileName, folder in report['deleted']:
+        lines.append('deleted  ' + fileName + ' from ' + folder)
+    for fileName, reason in report['conflicts']:
+        lines.append('conflict ' + fileName + ', ' + reason)
+    lines.append('%d copied, %d renamed, %d deleted, %d conflicts. %d bytes transferred, %d bytes reused, '
+                 '%d files hashed in %.2fs' % (
+                     len(report['copied']), len(report['renamed']), len(report['deleted']), len(report['conflicts']),
+                     report['bytesTransferred'], report['bytesReused'], report['filesHashed'], report['seconds']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    arguments = [argument for argument in sys.argv[1:] if argument != '--dry-run']
+    if len(arguments) != 2:
+        print('usage: python MacroToolsSync.py folderA folderB [--dry-run]')
+        sys.exit(1)
+    print(formatSyncReport(syncMacroFolders(arguments[0], arguments[1], dryRun='--dry-run' in sys.argv)))
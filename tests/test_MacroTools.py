@@ -0,0 +1,382 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock  # Python 2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MacroTools'))
+
+# MacroTools runs inside Maya, the Maya and Qt modules are replaced so its pure python parts can be tested
+for moduleName in ('maya', 'maya.OpenMaya', 'maya.OpenMayaUI', 'maya.cmds', 'maya.mel', 'maya.utils',
+                   'PySide2', 'shiboken2'):
+    sys.modules.setdefault(moduleName, mock.MagicMock())
+
+import MacroTools
+
+
+class MacroStorageTest(unittest.TestCase):
+
+    macroText = u'// caf\xe9\npolyCube -w 2;\n' * 100
+
+    def setUp(self):
+        self.folderPath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folderPath)
+
+    def _roundTrip(self, fileName):
+        macroPath = os.path.join(self.folderPath, fileName)
+        MacroTools.writeMacroFile(macroPath, self.macroText)
+        self.assertEqual(MacroTools.readMacroFile(macroPath), self.macroText)
+        self.assertEqual(os.listdir(self.folderPath), [fileName])
+        return macroPath
+
+    def test_plainRoundTrip(self):
+        macroPath = self._roundTrip('a.txt')
+        with open(macroPath, 'rb') as openMacroFile:
+            self.assertEqual(openMacroFile.read(), self.macroText.encode('utf-8'))
+
+    def test_gzipRoundTrip(self):
+        self._roundTrip('a.txt.gz')
+
+    @unittest.skipIf(MacroTools.zstandard is None, 'zstandard is not installed')
+    def test_zstdRoundTrip(self):
+        self._roundTrip('a.txt.zst')
+
+    def test_bytesReadAreCompressedBytes(self):
+        macroPath = self._roundTrip('a.txt.gz')
+        metric = MacroTools.startOperationMetric('test', self.folderPath)
+        MacroTools.readMacroFile(macroPath)
+        MacroTools.finishOperationMetric(metric)
+        # GzipFile in Python 2 reads the end of the file twice
+        self.assertGreaterEqual(metric['bytesRead'], os.path.getsize(macroPath))
+        self.assertLess(metric['bytesRead'], os.path.getsize(macroPath) + 64)
+
+    def test_nonUtf8MacroIsReadWithReplacement(self):
+        macroPath = os.path.join(self.folderPath, 'a.txt')
+        with open(macroPath, 'wb') as openMacroFile:
+            openMacroFile.write(b'// caf\xe9\npolyCube;\n')
+        self.assertEqual(MacroTools.readMacroFile(macroPath), u'// caf\ufffd\npolyCube;\n')
+        with self.assertRaises(UnicodeDecodeError):
+            MacroTools.readMacroFile(macroPath, errors='strict')
+
+    def test_findExistingMacroPathDoesNotUseMaya(self):
+        # It runs on the background threads, where Maya commands can not be used
+        with mock.patch.object(MacroTools, 'cmds') as cmds:
+            self.assertIsNone(MacroTools.findExistingMacroPath(self.folderPath, 'a'))
+            macroPath = self._roundTrip('a.txt.gz')
+            self.assertEqual(MacroTools.findExistingMacroPath(self.folderPath, 'a'), macroPath.replace(os.sep, '/'))
+        self.assertEqual(cmds.mock_calls, [])
+
+    def test_convertSkipsNonUtf8Macros(self):
+        MacroTools.writeMacroFile(os.path.join(self.folderPath, 'good.txt'), self.macroText)
+        with open(os.path.join(self.folderPath, 'bad.txt'), 'wb') as openMacroFile:
+            openMacroFile.write(b'// caf\xe9\n')
+
+        report = MacroTools.convertMacroFolder(self.folderPath, 'gzip')
+
+        self.assertEqual([entry['macro'] for entry in report if 'error' in entry], ['bad'])
+        self.assertEqual(sorted(os.listdir(self.folderPath)), ['bad.txt', 'good.txt.gz'])
+        self.assertEqual(MacroTools.readMacroFile(os.path.join(self.folderPath, 'good.txt.gz')), self.macroText)
+
+
+class MacroCommandRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folderPath = tempfile.mkdtemp()
+        self.recordingPath = os.path.join(self.folderPath, 'macro.txt')
+        self.deferred = []
+        self.runTimeCommands = set(['CreatePolygonCube', 'DeleteHistory'])
+
+        cmds = mock.MagicMock()
+        cmds.runTimeCommand.side_effect = lambda name, exists: name in self.runTimeCommands
+        utils = mock.MagicMock()
+        utils.executeDeferred.side_effect = lambda function, *args: self.deferred.append(function)
+        patches = [mock.patch.object(MacroTools, 'cmds', cmds), mock.patch.object(MacroTools.maya, 'utils', utils)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.recorder = MacroTools.MacroCommandRecorder(self.recordingPath)
+
+    def tearDown(self):
+        shutil.rmtree(self.folderPath)
+
+    def _idle(self):
+        while self.deferred:
+            self.deferred.pop(0)()
+
+    def _recordedCommands(self):
+        self.recorder.flush()
+        with open(self.recordingPath) as openRecordingFile:
+            return [line.split('  //')[0] for line in openRecordingFile]
+
+    def test_runTimeCommandIsRecordedOnce(self):
+        # CreatePolygonCube runs performPolyPrimitive, which runs polyCube
+        self.recorder._commandCallback('CreatePolygonCube')
+        self.recorder._procedureCallback('performPolyPrimitive', 1, True)
+        self.recorder._commandCallback('polyCube -w 1 -h 1 -d 1')
+        self.recorder._procedureCallback('performPolyPrimitive', 1, False)
+        self._idle()
+        self.recorder._commandCallback('move -r 0 1 0')
+
+        self.assertEqual(self._recordedCommands(), ['CreatePolygonCube;', 'move -r 0 1 0;'])
+
+    def test_runTimeCommandWithoutProcedure(self):
+        # DeleteHistory runs delete directly, without a procedure around it
+        self.recorder._commandCallback('DeleteHistory')
+        self.recorder._commandCallback('delete -ch')
+        self._idle()
+        self.recorder._commandCallback('delete -ch')
+
+        self.assertEqual(self._recordedCommands(), ['DeleteHistory;', 'delete -ch;'])
+
+    def test_queriesAreDropped(self):
+        self.recorder._commandCallback('getAttr pCube1.tx')
+        self.recorder._commandCallback('polySphere -q -r')
+        self.recorder._commandCallback('polySphere')
+
+        self.assertEqual(self._recordedCommands(), ['polySphere;'])
+
+    def test_recordsAreTimestamped(self):
+        self.recorder.startTime = MacroTools.time.time() - 2.0
+        self.recorder._commandCallback('polySphere')
+        self.recorder.flush()
+        with open(self.recordingPath) as openRecordingFile:
+            line = openRecordingFile.readline()
+
+        self.assertTrue(line.startswith('polySphere;  // t='))
+        self.assertAlmostEqual(float(line.split('t=')[1]), 2.0, places=1)
+
+
+class MacroProcedureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folderPath = tempfile.mkdtemp()
+        self.macroPath = os.path.join(self.folderPath, 'macro.txt')
+        patch = mock.patch.object(MacroTools, 'mel', mock.MagicMock())
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        MacroTools.invalidateMacroProcedure(self.macroPath)
+        shutil.rmtree(self.folderPath)
+
+    def test_sameSizeEditWithSameModifiedTime(self):
+        MacroTools.writeMacroFile(self.macroPath, 'polyCube;\n')
+        modifiedTime = os.path.getmtime(self.macroPath)
+        firstCall = MacroTools.getMacroProcedureCall(self.macroPath)
+
+        # An edit within the modified time resolution of the share
+        MacroTools.writeMacroFile(self.macroPath, 'polyCone;\n')
+        os.utime(self.macroPath, (modifiedTime, modifiedTime))
+
+        self.assertNotEqual(MacroTools.getMacroProcedureCall(self.macroPath), firstCall)
+
+    def test_unchangedMacroKeepsProcedure(self):
+        MacroTools.writeMacroFile(self.macroPath, 'polyCube;\n')
+        firstCall = MacroTools.getMacroProcedureCall(self.macroPath)
+        MacroTools.mel.eval.reset_mock()
+
+        self.assertEqual(MacroTools.getMacroProcedureCall(self.macroPath), firstCall)
+        MacroTools.mel.eval.assert_not_called()
+
+
+class PlaceholdersToVariablesTest(unittest.TestCase):
+
+    def assertCompiles(self, macroText, expected):
+        self.assertEqual(MacroTools._placeholdersToVariables(macroText), expected)
+
+    def test_standalonePlaceholder(self):
+        self.assertCompiles('move -r {{x}} 0 0;', 'move -r $x 0 0;')
+
+    def test_subtraction(self):
+        self.assertCompiles('$a = {{x}}-1;', '$a = $x-1;')
+        self.assertCompiles('$a = {{x}} - {{y}};', '$a = $x - $y;')
+        self.assertCompiles('$a = {{x}}-{{y}};', '$a = $x-$y;')
+        self.assertCompiles('$a = 10%{{x}};', '$a = 10%$x;')
+
+    def test_negation(self):
+        self.assertCompiles('move -r -{{x}} 0 0;', 'move -r (-$x) 0 0;')
+        self.assertCompiles('$a = 2*-{{x}};', '$a = 2*(-$x);')
+        self.assertCompiles('$a = -{{x}};', '$a = (-$x);')
+        self.assertCompiles('move -r 1 -{{x}} 0;', 'move -r 1 (-$x) 0;')
+
+    def test_spacedMinusInExpressionSubtracts(self):
+        self.assertCompiles('$a = 1 -{{x}};', '$a = 1 -$x;')
+        self.assertCompiles('$a = {{x}} -{{y}};', '$a = $x -$y;')
+        self.assertCompiles('move -r (1 -{{x}}) 0 0;', 'move -r (1 -$x) 0 0;')
+        self.assertCompiles('if ($a > 1 -{{x}}) polyCube;', 'if ($a > 1 -$x) polyCube;')
+        self.assertCompiles('return 1 -{{x}};', 'return 1 -$x;')
+
+    def test_placeholderInVariableNameIsRejected(self):
+        with self.assertRaises(ValueError):
+            MacroTools._placeholdersToVariables('select $obj{{n}};')
+
+    def test_placeholderInVariableNameIsSubstituted(self):
+        with mock.patch.object(MacroTools, 'mel') as mel:
+            MacroTools.runMacroIterations('select $obj{{n}};', [{'n': 1}, {'n': 2}])
+        self.assertEqual([call[0][0] for call in mel.eval.call_args_list], ['select $obj1;', 'select $obj2;'])
+
+    def test_placeholderInName(self):
+        self.assertCompiles('select pCube{{n}};', 'select ("pCube" + $n);')
+        self.assertCompiles('setAttr pCube{{n}}.tx 1;', 'setAttr ("pCube" + $n + ".tx") 1;')
+        self.assertCompiles('select group1|pCube{{n}};', 'select ("group1|pCube" + $n);')
+
+    def test_placeholderInString(self):
+        self.assertCompiles('print "value {{x}}\\n";', 'print ("value " + $x + "\\n");')
+
+    def test_commentsAreLeftAlone(self):
+        self.assertCompiles('// move {{x}}\npolyCube;', '// move {{x}}\npolyCube;')
+        self.assertCompiles('/* -{{x}} */ polyCube;', '/* -{{x}} */ polyCube;')
+
+
+class CompilePlaylistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folderPath = tempfile.mkdtemp()
+        MacroTools.writeMacroFile(os.path.join(self.folderPath, 'a.txt'), 'string $sel[] = `ls`;\n')
+        MacroTools.writeMacroFile(os.path.join(self.folderPath, 'b.txt'), 'float $sel = 1.0;\n')
+        MacroTools.writePlaylist(os.path.join(self.folderPath, 'both.playlist'), ['a', 'b'])
+
+    def tearDown(self):
+        MacroTools._playlistCache.clear()
+        shutil.rmtree(self.folderPath)
+
+    def _touch(self, fileName, seconds):
+        filePath = os.path.join(self.folderPath, fileName)
+        modifiedTime = os.path.getmtime(filePath) + seconds
+        os.utime(filePath, (modifiedTime, modifiedTime))
+
+    def test_membersAreScopedInBlocks(self):
+        compiled, timings = MacroTools.compilePlaylist(self.folderPath, 'both')
+        self.assertEqual(compiled, '// MacroTools playlist: a\n{\nstring $sel[] = `ls`;\n}\n'
+                                   '// MacroTools playlist: b\n{\nfloat $sel = 1.0;\n}\n')
+
+    def test_unchangedPlaylistIsCached(self):
+        MacroTools.compilePlaylist(self.folderPath, 'both')
+        with mock.patch.object(MacroTools, 'readMacroFile') as readMacroFile:
+            compiled, timings = MacroTools.compilePlaylist(self.folderPath, 'both')
+        readMacroFile.assert_not_called()
+        self.assertEqual(timings['compile'], 0.0)
+        self.assertIn('float $sel', compiled)
+
+    def test_modifiedMemberIsCompiledAgain(self):
+        MacroTools.compilePlaylist(self.folderPath, 'both')
+        MacroTools.writeMacroFile(os.path.join(self.folderPath, 'b.txt'), 'polyCube;\n')
+        self._touch('b.txt', 2)
+
+        compiled, timings = MacroTools.compilePlaylist(self.folderPath, 'both')
+        self.assertIn('polyCube;', compiled)
+        self.assertNotIn('float $sel', compiled)
+
+    def test_modifiedPlaylistIsCompiledAgain(self):
+        MacroTools.compilePlaylist(self.folderPath, 'both')
+        MacroTools.writePlaylist(os.path.join(self.folderPath, 'both.playlist'), ['b'])
+        self._touch('both.playlist', 2)
+
+        compiled, timings = MacroTools.compilePlaylist(self.folderPath, 'both')
+        self.assertNotIn('playlist: a', compiled)
+
+    def test_missingMember(self):
+        MacroTools.writePlaylist(os.path.join(self.folderPath, 'broken.playlist'), ['a', 'missing'])
+        with self.assertRaises(ValueError):
+            MacroTools.compilePlaylist(self.folderPath, 'broken')
+
+    def test_listPlaylists(self):
+        self.assertEqual(MacroTools.listPlaylists(self.folderPath), ['both'])
+
+
+class SegmentedMacroTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folderPath = tempfile.mkdtemp()
+        self.macroPath = self.folderPath + '/macro' + MacroTools.segmentedMacroExtension
+        os.mkdir(self.macroPath)
+        MacroTools.writeSegmentManifest(self.macroPath, {'segments': []})
+
+    def tearDown(self):
+        shutil.rmtree(self.folderPath)
+
+    def _segmentText(self, segmentPath):
+        with open(segmentPath, 'rb') as openSegmentFile:
+            return openSegmentFile.read().decode('utf-8')
+
+    def test_rotatesOnLineBoundary(self):
+        writer = MacroTools.MacroSegmentWriter(self.macroPath, segmentSize=25)
+        writer.write('polyCube;\npolySphere;\n')  # 22 bytes, not full yet
+        writer.write('move -r 1 0 0;\nmove')  # Full, but ends inside a line so it keeps going
+        writer.write(' -r 2 0 0;\n')
+        writer.write('polyCone;\n')
+        writer.close()
+
+        segments = MacroTools.getMacroSegments(self.macroPath)
+        self.assertEqual([self._segmentText(segmentPath) for segmentPath in segments],
+                         ['polyCube;\npolySphere;\nmove -r 1 0 0;\nmove -r 2 0 0;\n', 'polyCone;\n'])
+        self.assertEqual(MacroTools.validateSegmentedMacro(self.macroPath), [])
+
+        manifest = MacroTools.readSegmentManifest(self.macroPath)
+        self.assertEqual([segment['lines'] for segment in manifest['segments']], [4, 1])
+        self.assertEqual(os.listdir(self.macroPath).count(MacroTools.segmentManifestName + '.tmp'), 0)
+
+    def test_interruptedSegmentIsSkippedAndFlagged(self):
+        writer = MacroTools.MacroSegmentWriter(self.macroPath, segmentSize=10)
+        writer.write('polyCube;\n')
+        writer.write('polySphere;\n')
+        # Maya closes before the writer is closed, the last segment is never finished
+
+        segments = MacroTools.getMacroSegments(self.macroPath)
+        self.assertEqual([os.path.basename(segmentPath) for segmentPath in segments],
+                         ['segment_00000.txt', 'segment_00001.txt'])
+
+        with mock.patch.object(MacroTools, 'mel') as mel:
+            MacroTools.playMacro(self.macroPath)
+        self.assertEqual([call[0][0] for call in mel.eval.call_args_list],
+                         ['source "' + segmentPath + '";' for segmentPath in segments])
+
+        problems = MacroTools.validateSegmentedMacro(self.macroPath)
+        self.assertEqual(len(problems), 1)
+        self.assertIn('segment_00002.txt', problems[0])
+
+    def test_changedSegmentIsFlagged(self):
+        writer = MacroTools.MacroSegmentWriter(self.macroPath)
+        writer.write('polyCube;\n')
+        writer.close()
+        with open(self.macroPath + '/segment_00000.txt', 'a') as openSegmentFile:
+            openSegmentFile.write('polySphere;\n')
+
+        problems = MacroTools.validateSegmentedMacro(self.macroPath)
+        self.assertEqual(len(problems), 1)
+        self.assertIn('hash', problems[0])
+
+    def test_streamReadsAcrossSegments(self):
+        lines = ['move -r %d 0 0;\n' % index for index in range(50)]
+        writer = MacroTools.MacroSegmentWriter(self.macroPath, segmentSize=100)
+        for line in lines:
+            writer.write(line)
+        writer.close()
+        self.assertGreater(len(MacroTools.getMacroSegments(self.macroPath)), 3)
+
+        self.assertEqual(MacroTools.readMacroFile(self.macroPath), ''.join(lines))
+        stream = MacroTools.openMacroStream(self.macroPath)
+        try:
+            chunks = []
+            while True:
+                chunk = stream.read(7)
+                if not chunk:
+                    break
+                self.assertLessEqual(len(chunk), 7)
+                chunks.append(chunk)
+        finally:
+            stream.close()
+        self.assertEqual(''.join(chunks), ''.join(lines))
+        self.assertEqual(list(MacroTools.openMacroStream(self.macroPath)), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
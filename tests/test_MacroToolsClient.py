@@ -0,0 +1,74 @@
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MacroTools'))
+
+import MacroToolsClient
+
+
+class MacroToolsClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MacroToolsClient.LocalMacroServer().start()
+        self.client = MacroToolsClient.MacroToolsClient(port=self.server.port, timeout=5.0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_runMacro(self):
+        result = self.client.runMacro('myMacro', {'offset': 5})
+        self.assertTrue(result['success'])
+        self.assertEqual(result['macro'], 'myMacro')
+        self.assertIn('roundTrip', result['timings'])
+
+    def test_runMacrosKeepsOrder(self):
+        results = self.client.runMacros(['macroA', ('macroB', {'name': 'pCube1'}), 'macroC'])
+        self.assertEqual([result['macro'] for result in results], ['macroA', 'macroB', 'macroC'])
+
+    def test_benchmarkDefaultBatchFitsBuffer(self):
+        result = self.client.benchmark('myMacro', count=250)
+        self.assertEqual(result['requests'], 250)
+        self.assertEqual(result['failures'], 0)
+
+    def test_batchesAreSplitToFitBuffer(self):
+        self.client.bufferSize = self.server.bufferSize = 4096
+        calls = []
+        call = self.client._call
+        self.client._call = lambda requests: calls.append(len(requests)) or call(requests)
+
+        results = self.client.runMacros(['macro%d' % index for index in range(100)])
+        self.assertEqual(len(results), 100)
+        self.assertGreater(len(calls), 1)
+        for size in calls:
+            command = self.client._buildCommand([{'id': 0, 'macro': 'macro00', 'parameters': {}}] * size)
+            self.assertLessEqual(len(command), 4096)
+
+    def test_requestLargerThanBufferIsRefused(self):
+        self.client.bufferSize = 4096
+        with self.assertRaises(ValueError):
+            self.client.runMacro('myMacro', {'text': 'x' * 5000})
+
+    def test_serverAnswersOncePerBuffer(self):
+        # Two calls in one buffer get a single error response, like Maya
+        connection = socket.create_connection(('localhost', self.server.port), timeout=5.0)
+        try:
+            command = self.client._buildCommand([{'id': 1, 'macro': 'a', 'parameters': {}}])
+            connection.sendall((command + command).encode('utf-8'))
+            response = self.client._readResponse(connection)
+        finally:
+            connection.close()
+        self.assertTrue(response.startswith('# Error'))
+
+    def test_failedResponseDropsConnection(self):
+        # The command is split across buffers on the server so its answer is an error
+        self.server.bufferSize = 64
+        with self.assertRaises(ValueError):
+            self.client.runMacro('myMacro')
+        self.assertEqual(self.client.connectionCount, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
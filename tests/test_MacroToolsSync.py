@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MacroTools'))
+
+import MacroToolsSync
+
+
+class SyncMacroFoldersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folderA = tempfile.mkdtemp()
+        self.folderB = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folderA)
+        shutil.rmtree(self.folderB)
+
+    def _write(self, folder, fileName, text):
+        with open(os.path.join(folder, fileName), 'wb') as openFile:
+            openFile.write(text.encode('utf-8'))
+        # Make sure the change is seen even on file systems with a coarse modified time
+        modifiedTime = os.path.getmtime(os.path.join(folder, fileName)) + 1
+        os.utime(os.path.join(folder, fileName), (modifiedTime, modifiedTime))
+
+    def _read(self, folder, fileName):
+        with open(os.path.join(folder, fileName), 'rb') as openFile:
+            return openFile.read().decode('utf-8')
+
+    def _files(self, folder):
+        return sorted(name for name in os.listdir(folder) if name != MacroToolsSync.manifestName)
+
+    def test_copiesNewFilesBothWays(self):
+        self._write(self.folderA, 'a.txt', 'polyCube;\n')
+        self._write(self.folderB, 'b.txt', 'polySphere;\n')
+        report = MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        self.assertEqual(len(report['copied']), 2)
+        self.assertEqual(self._files(self.folderA), ['a.txt', 'b.txt'])
+        self.assertEqual(self._files(self.folderB), ['a.txt', 'b.txt'])
+
+        # A second sync has nothing to do and hashes nothing
+        report = MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+        self.assertEqual(report['copied'], [])
+        self.assertEqual(report['filesHashed'], 0)
+
+    def test_renameIsMovedNotCopied(self):
+        self._write(self.folderA, 'a.txt', 'polyCube;\n' * 100)
+        MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        os.rename(os.path.join(self.folderA, 'a.txt'), os.path.join(self.folderA, 'renamed.txt'))
+        report = MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        self.assertEqual(report['renamed'], [('a.txt', 'renamed.txt', self.folderB)])
+        self.assertEqual(report['copied'], [])
+        self.assertEqual(report['bytesTransferred'], 0)
+        self.assertEqual(self._files(self.folderB), ['renamed.txt'])
+
+    def test_deleteIsSynced(self):
+        self._write(self.folderA, 'a.txt', 'polyCube;\n')
+        self._write(self.folderA, 'b.txt', 'polySphere;\n')
+        MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        os.remove(os.path.join(self.folderB, 'b.txt'))
+        report = MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        self.assertEqual(report['deleted'], [('b.txt', self.folderA)])
+        self.assertEqual(self._files(self.folderA), ['a.txt'])
+
+    def test_conflictIsLeftAlone(self):
+        self._write(self.folderA, 'a.txt', 'polyCube;\n')
+        MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        self._write(self.folderA, 'a.txt', 'polyCube -w 2;\n')
+        self._write(self.folderB, 'a.txt', 'polyCube -w 3;\n')
+        report = MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        self.assertEqual([fileName for fileName, reason in report['conflicts']], ['a.txt'])
+        self.assertEqual(self._read(self.folderA, 'a.txt'), 'polyCube -w 2;\n')
+        self.assertEqual(self._read(self.folderB, 'a.txt'), 'polyCube -w 3;\n')
+
+        # The conflict is still reported until it is resolved
+        report = MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+        self.assertEqual(len(report['conflicts']), 1)
+
+    def test_changedFileReusesBlocks(self):
+        lines = ['move -r %d 0 0;\n' % index for index in range(20000)]
+        self._write(self.folderA, 'big.txt', ''.join(lines))
+        MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        lines[10000] = 'polyCube;\n'
+        self._write(self.folderA, 'big.txt', ''.join(lines))
+        report = MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        self.assertEqual(self._read(self.folderB, 'big.txt'), ''.join(lines))
+        self.assertGreater(report['bytesReused'], 0)
+        self.assertLess(report['bytesTransferred'], MacroToolsSync.maxBlockSize * 3)
+        self.assertEqual(report['bytesTransferred'] + report['bytesReused'], len(''.join(lines)))
+
+    def test_dryRunChangesNothing(self):
+        self._write(self.folderA, 'a.txt', 'polyCube;\n')
+        report = MacroToolsSync.syncMacroFolders(self.folderA, self.folderB, dryRun=True)
+
+        self.assertEqual(len(report['copied']), 1)
+        self.assertEqual(self._files(self.folderB), [])
+        self.assertFalse(os.path.exists(os.path.join(self.folderA, MacroToolsSync.manifestName)))
+        self.assertFalse(os.path.exists(os.path.join(self.folderB, MacroToolsSync.manifestName)))
+
+    def test_temporaryAndRecordingFilesAreSkipped(self):
+        self._write(self.folderA, 'x.txt', 'polyCube;\n')
+        self._write(self.folderA, 'y.txt.tmp', 'polySphere;\n')
+        self._write(self.folderA, 'z.txt.gz.recording', 'polyCone;\n')
+        MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        self.assertEqual(self._files(self.folderB), ['x.txt'])
+
+    def test_unfinishedSegmentIsSkipped(self):
+        segmentsFolder = os.path.join(self.folderA, 'rec.segments')
+        os.mkdir(segmentsFolder)
+        self._write(segmentsFolder, '00000.txt', 'polyCube;\n')
+        self._write(segmentsFolder, '00001.txt', 'polySph')
+        self._write(segmentsFolder, 'manifest.json', json.dumps({'segments': [
+            {'file': '00000.txt', 'complete': True}, {'file': '00001.txt', 'complete': False}]}))
+        self._write(segmentsFolder, 'manifest.json.tmp', '{')
+        MacroToolsSync.syncMacroFolders(self.folderA, self.folderB)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.folderB, 'rec.segments'))),
+                         ['00000.txt', 'manifest.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()